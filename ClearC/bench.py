@@ -0,0 +1,192 @@
+"""
+Simple program to benchmark stages of the compiler.
+Given a benchmark name, it runs that stage over generated inputs of increasing size and prints
+the time taken, so that the scaling of the stage can be checked.
+"""
+
+from typing import Callable, Dict, List, Tuple
+
+import sys
+import time
+
+import clr.ast as ast
+import clr.codegenerator as cg
+import clr.errors as er
+import clr.lexer as lx
+import clr.parser as ps
+import clr.passes as pm
+
+LEX_CHUNK = """
+// A chunk of source exercising most kinds of token
+func scale(int x, num y) num {
+    val total := num(x) * y + 2.5;
+    if (total >= 10.0 and x != 3i) {
+        print "big: " + str(total);
+    }
+    return total / 1.0;
+}
+"""
+
+DECL_CHUNK = """
+val v{i} := {i}i;
+func f{i}(int x) int {{
+    val y := x + v{i};
+    val g := func(int z) (z + y + x);
+    return g(y);
+}}
+"""
+
+UNION_CHUNK = """
+func u{i}((int | num | str | bool)? v, (int, (num | str)?) t) (str | int)? {{
+    val w := case(v) as x {{
+        int: x,
+        (num | bool): "nb",
+        str: x,
+        else: nil
+    }};
+    return w;
+}}
+val r{i} := u{i}(1i, (2i, "s"));
+"""
+
+NESTED_LEVEL = """
+if (x > {i}i) {{
+    val f{i} := func(int y) (y + x);
+    while (x < {i}i) {{
+        {inner}
+    }}
+}}
+"""
+
+
+STRUCT_ACCESS = """
+print s.f{i};
+"""
+
+
+def _wide_struct(fields: int) -> er.SourceFile:
+    # A struct with many fields, each of which is accessed once
+    params = "".join(f"int f{i}; " for i in range(fields))
+    inits = ", ".join(f"f{i}={i}i" for i in range(fields))
+    accesses = "".join(STRUCT_ACCESS.format(i=i) for i in range(fields))
+    return er.SourceFile(
+        text=f"struct Wide {{ {params}}} val s := Wide {{ {inits} }}; {accesses}"
+    )
+
+
+def _repeat(chunk: str, size: int) -> er.SourceFile:
+    return er.SourceFile(text=chunk * max(1, size // len(chunk)))
+
+
+def _declarations(chunk: str, count: int) -> er.SourceFile:
+    # Count the declarations in the chunk by their keywords
+    per_chunk = chunk.count("val ") + chunk.count("func ")
+    return er.SourceFile(
+        text="".join(chunk.format(i=i) for i in range(max(1, count // per_chunk)))
+    )
+
+
+def _nested(depth: int) -> er.SourceFile:
+    inner = "print x;"
+    for i in reversed(range(depth)):
+        inner = NESTED_LEVEL.format(i=i, inner=inner)
+    return er.SourceFile(text=f"func nested(int x) int {{ {inner} return x; }}")
+
+
+def _analysed(source: er.SourceFile) -> ast.Ast:
+    tree = ps.parse_tokens(lx.stream_source(source, er.ErrorTracker()))
+    assert isinstance(tree, ast.Ast)
+    for group in pm.SEMANTIC_PIPELINE:
+        tree.accept(group.make_visitor())
+    return tree
+
+
+def _time(func: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def _bench_lex(size: int) -> float:
+    source = _repeat(LEX_CHUNK, size)
+    return _time(lambda: lx.stream_source(source, er.ErrorTracker()).finish())
+
+
+def _bench_parse(size: int) -> float:
+    source = _repeat(LEX_CHUNK, size)
+    return _time(lambda: ps.parse_tokens(lx.stream_source(source, er.ErrorTracker())))
+
+
+def _bench_passes(chunk: str, size: int) -> float:
+    source = _declarations(chunk, size)
+    tree = ps.parse_tokens(lx.stream_source(source, er.ErrorTracker()))
+    assert isinstance(tree, ast.Ast)
+
+    def run() -> None:
+        for group in pm.SEMANTIC_PIPELINE:
+            tree.accept(group.make_visitor())
+
+    return _time(run)
+
+
+def _bench_semantic(size: int) -> float:
+    return _bench_passes(DECL_CHUNK, size)
+
+
+def _bench_unions(size: int) -> float:
+    return _bench_passes(UNION_CHUNK, size)
+
+
+def _bench_codegen(size: int) -> float:
+    # Every level of nesting recurses through the parser and visitors
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100 * size))
+    tree = _analysed(_nested(size))
+    return _time(lambda: cg.generate_code(tree))
+
+
+def _bench_structs(size: int) -> float:
+    source = _wide_struct(size)
+    tree = ps.parse_tokens(lx.stream_source(source, er.ErrorTracker()))
+    assert isinstance(tree, ast.Ast)
+
+    def run() -> None:
+        for group in pm.SEMANTIC_PIPELINE:
+            tree.accept(group.make_visitor())
+        cg.generate_code(tree)
+
+    return _time(run)
+
+
+BENCHMARKS: Dict[str, Tuple[Callable[[int], float], List[int]]] = {
+    "lex": (_bench_lex, [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]),
+    "parse": (_bench_parse, [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]),
+    # Sized by the number of declarations
+    "semantic": (_bench_semantic, [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5]),
+    "unions": (_bench_unions, [10 ** 2, 10 ** 3, 10 ** 4, 10 ** 5]),
+    # Sized by the depth of nesting
+    "codegen": (_bench_codegen, [100, 200, 400, 800]),
+    # Sized by the number of fields
+    "structs": (_bench_structs, [10 ** 2, 10 ** 3, 10 ** 4]),
+}
+
+
+def main() -> None:
+    """
+    The main entry point function.
+    """
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Please provide a benchmark to run")
+        print("Usage:")
+        print(f"$ bench <{' | '.join(BENCHMARKS)}>")
+        sys.exit(1)
+
+    bench, sizes = BENCHMARKS[sys.argv[1]]
+    print(f"{'size':>10} | {'seconds':>10} | {'us per unit':>12}")
+    for size in sizes:
+        seconds = bench(size)
+        print(f"{size:>10} | {seconds:>10.4f} | {10 ** 6 * seconds / size:>12.4f}")
+
+
+if __name__ == "__main__":
+
+    main()
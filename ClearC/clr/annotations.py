@@ -35,6 +35,8 @@ class IndexAnnotType(enum.Enum):
     GLOBAL = enum.auto()
     LOCAL = enum.auto()
     UPVALUE = enum.auto()
+    # An upvalue that's never set, so the function keeps a copy of the value
+    CAPTURE = enum.auto()
     PARAM = enum.auto()
     UNRESOLVED = enum.auto()
 
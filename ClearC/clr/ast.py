@@ -437,7 +437,7 @@ class AstNode:
     Base class for an ast node. All nodes must be able to accept an ast visitor.
     """
 
-    region: er.SourceView = er.SourceView.all("")
+    region: er.SourceView = er.SourceView.all(er.EMPTY_SOURCE)
 
     def accept(self, visitor: AstVisitor) -> None:
         """
@@ -520,6 +520,7 @@ AstStmt = Union[
 ]
 
 
+@dc.dataclass(eq=False, repr=False)
 class AstNameDecl(AstDecl):
     """
     Base class for name declarations, annotated with possible decorators.
@@ -540,6 +541,7 @@ class Ast(AstScope):
     decls: List[AstDecl] = dc.field(default_factory=list)
     # Annotations:
     sequence: List[AstDecl] = dc.field(default_factory=list)
+    global_count: int = 0
 
     def accept(self, visitor: AstVisitor) -> None:
         visitor.start(self)
@@ -554,6 +556,7 @@ class AstBinding(AstTyped, AstIndexed):
     name: str = ""
     # Annotations:
     dependency: Optional[AstNameDecl] = None
+    mutated: bool = False
 
     def accept(self, visitor: AstVisitor) -> None:
         visitor.binding(self)
@@ -630,9 +633,20 @@ class AstStructDecl(AstDecl, AstTyped):
             self.generators.append(
                 (AstFuncDecl(params=params, block=AstBlockStmt(decls=decls)), bindings)
             )
+        # Field bindings and the generators declaring them by name, keeping the first of any
+        # duplicates
+        self.fields: Dict[str, AstBinding] = {}
+        self.field_generators: Dict[str, "AstFuncDecl"] = {}
+        for param in self.params:
+            self.fields.setdefault(param.binding.name, param.binding)
+        for generator, bindings in self.generators:
+            for binding in bindings:
+                self.fields.setdefault(binding.name, binding)
+                self.field_generators.setdefault(binding.name, generator)
         # Annotations:
         self.indices: List[an.IndexAnnot] = []
         self.sequence: List["AstFuncDecl"] = []
+        self.slots: Dict[str, int] = {}
 
     def iter_bindings(self) -> Iterable[AstBinding]:
         """
@@ -748,7 +762,9 @@ class AstUnaryExpr(AstExpr):
     Ast node for a unary expression.
     """
 
-    operator: lx.Token = lx.Token(kind=lx.TokenType.ERROR, lexeme=er.SourceView.all(""))
+    operator: lx.Token = lx.Token(
+        kind=lx.TokenType.ERROR, lexeme=er.SourceView.all(er.EMPTY_SOURCE)
+    )
     target: AstExpr = dc.field(default_factory=AstExpr)
     # Annotations:
     opcodes: List[bc.Instruction] = dc.field(default_factory=list)
@@ -763,7 +779,9 @@ class AstBinaryExpr(AstExpr):
     Ast node for a binary expression.
     """
 
-    operator: lx.Token = lx.Token(kind=lx.TokenType.ERROR, lexeme=er.SourceView.all(""))
+    operator: lx.Token = lx.Token(
+        kind=lx.TokenType.ERROR, lexeme=er.SourceView.all(er.EMPTY_SOURCE)
+    )
     left: AstExpr = dc.field(default_factory=AstExpr)
     right: AstExpr = dc.field(default_factory=AstExpr)
     # Annotations:
@@ -778,9 +796,9 @@ class AstIntExpr(AstExpr):
     Ast node for an int literal.
     """
 
-    def __init__(self, literal: lx.Token) -> None:
-        super().__init__(region=literal.lexeme)
-        self.literal = str(literal)
+    def __init__(self, literal: str, region: er.SourceView) -> None:
+        super().__init__(region=region)
+        self.literal = literal
         self.value = int(self.literal[:-1])
 
     def accept(self, visitor: AstVisitor) -> None:
@@ -792,9 +810,9 @@ class AstNumExpr(AstExpr):
     Ast node for a num literal.
     """
 
-    def __init__(self, literal: lx.Token) -> None:
-        super().__init__(region=literal.lexeme)
-        self.literal = str(literal)
+    def __init__(self, literal: str, region: er.SourceView) -> None:
+        super().__init__(region=region)
+        self.literal = literal
         self.value = float(self.literal)
 
     def accept(self, visitor: AstVisitor) -> None:
@@ -806,9 +824,9 @@ class AstStrExpr(AstExpr):
     Ast node for a str literal.
     """
 
-    def __init__(self, literal: lx.Token) -> None:
-        super().__init__(region=literal.lexeme)
-        self.literal = str(literal)
+    def __init__(self, literal: str, region: er.SourceView) -> None:
+        super().__init__(region=region)
+        self.literal = literal
         self.value = self.literal[1:-1]
 
     def accept(self, visitor: AstVisitor) -> None:
@@ -855,9 +873,9 @@ class AstBoolExpr(AstExpr):
     Ast node for a boolean expression.
     """
 
-    def __init__(self, literal: lx.Token) -> None:
-        super().__init__(region=literal.lexeme)
-        self.value = str(literal) == "true"
+    def __init__(self, literal: str, region: er.SourceView) -> None:
+        super().__init__(region=region)
+        self.value = literal == "true"
 
     def accept(self, visitor: AstVisitor) -> None:
         visitor.bool_expr(self)
@@ -868,8 +886,8 @@ class AstNilExpr(AstExpr):
     Ast node for a nil literal.
     """
 
-    def __init__(self, literal: lx.Token) -> None:
-        super().__init__(region=literal.lexeme)
+    def __init__(self, region: er.SourceView) -> None:
+        super().__init__(region=region)
 
     def accept(self, visitor: AstVisitor) -> None:
         visitor.nil_expr(self)
@@ -2,16 +2,20 @@
 Contains classes/functions for describing and assembling Clear bytecode.
 """
 
-from typing import Union, Tuple, Sequence, Iterable, NamedTuple
+from typing import Union, Tuple, Sequence, Iterable, NamedTuple, Dict, List
 
+import dataclasses as dc
 import struct
 import enum
 
+# The length of a string constant in bytes has to fit in 32 bits
+STR_MAX = 2 ** 32 - 1
+
 
 class IndexTooLargeError(Exception):
     """
     Custom exception class raised when assembling code which contains indices that don't fit
-    in a byte.
+    in 16 bits.
     """
 
 
@@ -133,9 +137,10 @@ class ClrStr(NamedTuple):
         """
         Pack the constant into its assembly.
         """
-        arr = bytearray()
-        arr.append(len(self.unboxed))
-        arr.extend(self.unboxed.encode())
+        # The length is the number of bytes in the encoding rather than the number of characters
+        encoded = self.unboxed.encode()
+        arr = bytearray(struct.pack("I", len(encoded)))
+        arr.extend(encoded)
         return ConstantType.STR, arr
 
 
@@ -146,10 +151,7 @@ def assemble_header(constants: Sequence[PackedConstant]) -> bytearray:
     """
     Takes a sequence of packed constants and assembles a Clear constant header from them.
     """
-    if len(constants) > 255:
-        raise IndexTooLargeError
-    result = bytearray()
-    result.append(len(constants))
+    result = bytearray(struct.pack("H", _operand(len(constants), wide=True)))
     for (constant_type, constant_packed) in constants:
         result.append(constant_type.value)
         result.extend(constant_packed)
@@ -217,43 +219,208 @@ class Opcode(enum.Enum):
     SET_REF = 50
     IS_VAL_TYPE = 51
     IS_OBJ_TYPE = 52
+    WIDE = 53
+    TAIL_CALL = 54
+    CALL_DIRECT = 55
+    SWITCH_VALTYPE = 56
+    SWITCH_TAG = 57
 
     def __str__(self) -> str:
         return "OP_" + self.name
 
 
-Instruction = Union[Opcode, int]
+# The number of operands following each opcode
+OPERAND_COUNTS: Dict[Opcode, int] = {opcode: 0 for opcode in Opcode}
+OPERAND_COUNTS.update(
+    {
+        Opcode.PUSH_CONST: 1,
+        Opcode.SET_GLOBAL: 1,
+        Opcode.PUSH_GLOBAL: 1,
+        Opcode.SET_LOCAL: 1,
+        Opcode.PUSH_LOCAL: 1,
+        Opcode.JUMP: 1,
+        Opcode.JUMP_IF_FALSE: 1,
+        Opcode.LOOP: 1,
+        Opcode.FUNCTION: 1,
+        Opcode.CALL: 1,
+        Opcode.STRUCT: 1,
+        Opcode.DESTRUCT: 1,
+        Opcode.GET_FIELD: 1,
+        Opcode.EXTRACT_FIELD: 2,
+        Opcode.SET_FIELD: 1,
+        Opcode.INSERT_FIELD: 2,
+        Opcode.REF_LOCAL: 1,
+        Opcode.IS_VAL_TYPE: 1,
+        Opcode.IS_OBJ_TYPE: 1,
+        Opcode.TAIL_CALL: 1,
+        Opcode.CALL_DIRECT: 2,
+        # Switches also have an offset for each entry in their table after the count
+        Opcode.SWITCH_VALTYPE: 2,
+        Opcode.SWITCH_TAG: 2,
+    }
+)
+
+
+@dc.dataclass(eq=False)
+class Label:
+    """
+    Class for a position in the instructions that jumps can refer to. Labels are resolved to
+    addresses when assembling and take up no space themselves.
+    """
+
+    # Name used to describe the label, such as the function that it ends
+    name: str = ""
+
+
+@dc.dataclass(frozen=True)
+class Offset:
+    """
+    Class for a jump operand which is the distance between the end of the operand and a label,
+    patched when assembling. Backwards offsets are used for loops.
+    """
+
+    label: Label
+    backwards: bool = False
+
+
+Instruction = Union[Opcode, int, Label, Offset]
+
+# Ops with a jump table, whose size is their first operand
+SWITCHES = {Opcode.SWITCH_VALTYPE, Opcode.SWITCH_TAG}
+
+
+def table_size(opcode: Opcode, first_operand: Instruction) -> int:
+    """
+    Returns the number of operands an op has in addition to OPERAND_COUNTS given its first
+    operand, which is the size of the jump table for switches.
+    """
+    if opcode in SWITCHES and isinstance(first_operand, int):
+        return first_operand
+    return 0
 
 
 def size(instructions: Iterable[Instruction]) -> int:
     """
-    Returns the size in bytes of an iterable of instructions after assembly.
+    Returns the size in bytes of an iterable of instructions after assembly, assuming none of
+    them need wide operands.
     """
-    # Currently redundant (equal to len) because everything is 1 byte
-    result = 0
+    # Everything apart from labels is 1 byte
+    return sum(1 for instruction in instructions if not isinstance(instruction, Label))
+
+
+# The largest operand that fits in a byte, and in the 2 bytes of a wide operand
+BYTE_MAX = 2 ** 8 - 1
+WIDE_MAX = 2 ** 16 - 1
+
+
+def _operand(value: int, wide: bool) -> int:
+    if value > (WIDE_MAX if wide else BYTE_MAX):
+        raise IndexTooLargeError
+    if value < 0:
+        raise NegativeIndexError
+    return value
+
+
+@dc.dataclass
+class _Op:
+    opcode: Opcode
+    operands: List[Union[int, Offset]]
+    wide: bool = False
+    # The address of the opcode, after the wide prefix if there is one
+    address: int = 0
+
+    def size(self) -> int:
+        return int(self.wide) + 1 + (2 if self.wide else 1) * len(self.operands)
+
+    def offset(self, index: int, addresses: Dict[Label, int]) -> int:
+        # Offsets are the distance from the end of the operands to the label
+        operand = self.operands[index]
+        assert isinstance(operand, Offset)
+        end = self.address + self.size() - int(self.wide)
+        target = addresses[operand.label]
+        return end - target if operand.backwards else target - end
+
+
+def _decode(instructions: Iterable[Instruction]) -> List[Union[Label, _Op]]:
+    result: List[Union[Label, _Op]] = []
+    operands = 0
     for instruction in instructions:
-        if isinstance(instruction, Opcode):
-            result += 1
+        if isinstance(instruction, Label):
+            result.append(instruction)
+        elif operands:
+            op = result[-1]
+            assert isinstance(op, _Op) and not isinstance(instruction, Opcode)
+            op.operands.append(instruction)
+            operands -= 1
+            if len(op.operands) == 1:
+                operands += table_size(op.opcode, instruction)
+        elif isinstance(instruction, Opcode):
+            result.append(_Op(instruction, []))
+            operands = OPERAND_COUNTS[instruction]
         else:
-            result += 1
+            raise ValueError(f"unexpected operand {instruction}")
     return result
 
 
+def _layout(ops: List[Union[Label, _Op]], start: int) -> Dict[Label, int]:
+    # Place the ops from a starting address, returning the address of each label
+    addresses: Dict[Label, int] = {}
+    address = start
+    for op in ops:
+        if isinstance(op, Label):
+            addresses[op] = address
+        else:
+            op.address = address + int(op.wide)
+            address += op.size()
+    return addresses
+
+
 def assemble_code(
     constants: Sequence[Constant], instructions: Iterable[Instruction]
 ) -> bytearray:
     """
     Takes a sequence of constants and an iterable of instructions and assembles them into a
     Clear bytecode program.
+
+    Ops with an operand that doesn't fit in a byte are prefixed with OP_WIDE, so that all of their
+    operands take 2 bytes.
     """
     result = assemble_header([constant.pack() for constant in constants])
-    for instruction in instructions:
-        if isinstance(instruction, Opcode):
-            result.append(instruction.value)
-        else:
-            if instruction > 255:
-                raise IndexTooLargeError
-            if instruction < 0:
-                raise NegativeIndexError
-            result.append(instruction)
+    ops = _decode(instructions)
+    for op in ops:
+        if isinstance(op, _Op):
+            op.wide = any(
+                isinstance(operand, int) and operand > BYTE_MAX
+                for operand in op.operands
+            )
+    # Widening a jump moves everything after it, which can make other jumps too long, so keep
+    # widening until every offset fits
+    while True:
+        addresses = _layout(ops, len(result))
+        widened = False
+        for op in ops:
+            if isinstance(op, _Op) and not op.wide:
+                if any(
+                    isinstance(operand, Offset) and op.offset(i, addresses) > BYTE_MAX
+                    for i, operand in enumerate(op.operands)
+                ):
+                    op.wide = True
+                    widened = True
+        if not widened:
+            break
+    for op in ops:
+        if isinstance(op, Label):
+            continue
+        if op.wide:
+            result.append(Opcode.WIDE.value)
+        result.append(op.opcode.value)
+        for i, operand in enumerate(op.operands):
+            value = _operand(
+                op.offset(i, addresses) if isinstance(operand, Offset) else operand,
+                op.wide,
+            )
+            if op.wide:
+                result.extend(struct.pack("H", value))
+            else:
+                result.append(value)
     return result
@@ -2,8 +2,9 @@
 Module for generating code from an annotated ast.
 """
 
-from typing import List, Tuple, Optional, Iterator, Dict
+from typing import List, Tuple, Optional, Iterator, Dict, DefaultDict, Set
 
+import collections as co
 import contextlib as cx
 
 import clr.ast as ast
@@ -13,15 +14,59 @@ import clr.bytecode as bc
 import clr.util as util
 
 
-def generate_code(tree: ast.Ast) -> Tuple[List[bc.Constant], List[bc.Instruction]]:
+def generate_code(
+    tree: ast.Ast, generator: Optional["CodeGenerator"] = None
+) -> Tuple[List[bc.Constant], List[bc.Instruction]]:
     """
-    Produce a list of instructions and constants from an annotated ast.
+    Produce a list of instructions and constants from an annotated ast, optionally using a given
+    code generator.
     """
-    generator = CodeGenerator()
+    if generator is None:
+        generator = CodeGenerator()
     tree.accept(generator)
     return generator.program.constants, generator.program.code
 
 
+# The vm value types of builtin types
+VALUE_TYPES: Dict[ts.UnitType, bc.ValueType] = {
+    ts.BuiltinType.BOOL: bc.ValueType.BOOL,
+    ts.BuiltinType.NIL: bc.ValueType.NIL,
+    ts.BuiltinType.INT: bc.ValueType.INT,
+    ts.BuiltinType.NUM: bc.ValueType.NUM,
+}
+
+
+class TypeTags:
+    """
+    Class for the registry of type tags given to structs, which keeps track of which tags contain
+    each unit type.
+    """
+
+    def __init__(self) -> None:
+        self.tags: List[ts.Type] = []
+        self.indices: Dict[ts.Type, int] = {}
+        self.by_unit: DefaultDict[ts.UnitType, List[int]] = co.defaultdict(list)
+
+    def index(self, type_annot: ts.Type) -> int:
+        """
+        Returns the tag for a type, registering it if it hasn't been seen before.
+        """
+        index = self.indices.get(type_annot)
+        if index is None:
+            index = len(self.tags)
+            self.tags.append(type_annot)
+            self.indices[type_annot] = index
+            for unit in type_annot.units:
+                self.by_unit[unit].append(index)
+        return index
+
+    def containing(self, unit: ts.UnitType) -> List[int]:
+        """
+        Returns the tags registered so far whose type contains the given unit type, in order.
+        """
+        return self.by_unit.get(unit, [])
+
+
 class Program:
     """
     Class wrapping a program with instructions and constants.
@@ -30,7 +75,19 @@ class Program:
     def __init__(self) -> None:
         self.code: List[bc.Instruction] = []
         self.constants: List[bc.Constant] = []
-        self.type_tags: List[ts.Type] = []
+        # Index of each constant keyed by its type and value, since constants of different types
+        # are never equal
+        self.constant_indices: Dict[Tuple[type, object], int] = {}
+        self.type_tags = TypeTags()
+        # Hidden globals holding the builtins that are used as values
+        self.builtin_globals: Dict[str, an.IndexAnnot] = {}
+        # Code to make the functions without upvalues, which are kept in hidden globals
+        self.closure_code: List[bc.Instruction] = []
+        # Placeholders for switches on type tags, with the target of each unit type and the
+        # default, since tags for a type can be registered after a switch on it
+        self.tag_switches: Dict[
+            bc.Label, Tuple[List[Tuple[ts.UnitType, bc.Label]], bc.Label]
+        ] = {}
 
     def declare(self, index_annot: an.IndexAnnot) -> None:
         """
@@ -47,94 +104,125 @@ class Program:
         """
         self.code.append(opcode)
 
-    def match_type(self, index_annot: an.IndexAnnot, type_annot: ts.Type) -> None:
-        """
-        Checks if the given value is of the given type.
-        """
-        value_types: Dict[ts.UnitType, bc.ValueType] = {
-            ts.BuiltinType.BOOL: bc.ValueType.BOOL,
-            ts.BuiltinType.NIL: bc.ValueType.NIL,
-            ts.BuiltinType.INT: bc.ValueType.INT,
-            ts.BuiltinType.NUM: bc.ValueType.NUM,
-        }
-
-        self.load(index_annot)
-        end_jumps = []
-
-        def end_true() -> None:
-            # Pop the target value
-            self.append_op(bc.Opcode.POP)
-            # Push the result
-            self.append_op(bc.Opcode.PUSH_TRUE)
-            # Jump to the end
-            end_jumps.append(self.begin_jump())
-
-        # Check against all the subtypes
-        for subtype in type_annot.units:
-            if subtype in value_types:
-                # If it's a value type just use IS_VAL_TYPE
-                self.append_op(bc.Opcode.IS_VAL_TYPE)
-                self.append_op(value_types[subtype].value)
-                with self.condition(True):
-                    end_true()
+    def switch(
+        self, opcode: bc.Opcode, targets: List[bc.Label], default: bc.Label
+    ) -> None:
+        """
+        Emit a switch with a jump table of the given targets, jumping to the default for values
+        with no entry in the table.
+        """
+        self.code.extend(_switch(opcode, targets, default))
+
+    def match_types(
+        self, type_annots: List[ts.Type], targets: List[bc.Label], default: bc.Label
+    ) -> None:
+        """
+        Jumps to the target of the first type containing the value on top of the stack, or to the
+        default if none of them do.
+        """
+        # The table covers all the value types that values of builtin types or objects can have
+        table_size = 1 + max(value_type.value for value_type in VALUE_TYPES.values())
+        value_targets = [default for _ in range(table_size)]
+        str_target: Optional[bc.Label] = None
+        tag_units: List[Tuple[ts.UnitType, bc.Label]] = []
+        for type_annot, target in reversed(list(zip(type_annots, targets))):
+            # Go through in reverse so that earlier types take precedence
+            for subtype in type_annot.units:
+                if subtype in VALUE_TYPES:
+                    value_targets[VALUE_TYPES[subtype].value] = target
+                elif subtype == ts.STR:
+                    str_target = target
+                elif isinstance(
+                    subtype, (ts.FunctionType, ts.TupleType, ts.StructType)
+                ):
+                    # Other types are type tagged structs
+                    tag_units.append((subtype, target))
+        if str_target is None and not tag_units:
+            self.switch(bc.Opcode.SWITCH_VALTYPE, value_targets, default)
+            return
+        # Objects need to be checked further
+        objects = bc.Label()
+        value_targets[bc.ValueType.OBJ.value] = objects
+        self.switch(bc.Opcode.SWITCH_VALTYPE, value_targets, default)
+        self.append_op(objects)
+        if str_target is not None:
+            self.append_op(bc.Opcode.IS_OBJ_TYPE)
+            self.append_op(bc.ObjectType.STRING.value)
+            self.append_op(bc.Opcode.NOT)
+            self.append_op(bc.Opcode.JUMP_IF_FALSE)
+            self.append_op(bc.Offset(str_target))
+        if tag_units:
+            # The jump table is filled in once all the tags are known
+            placeholder = bc.Label()
+            self.tag_switches[placeholder] = (tag_units, default)
+            self.append_op(placeholder)
+        else:
+            self.append_op(bc.Opcode.JUMP)
+            self.append_op(bc.Offset(default))
+
+    def resolve_tag_switches(self) -> None:
+        """
+        Replace the placeholders for switches on type tags with their jump tables. Must be called
+        after all the type tags have been registered.
+        """
+        code: List[bc.Instruction] = []
+        for instruction in self.code:
+            if not isinstance(instruction, bc.Label) or (
+                instruction not in self.tag_switches
+            ):
+                code.append(instruction)
+                continue
+            tag_units, default = self.tag_switches[instruction]
+            tag_targets: Dict[int, bc.Label] = {}
+            for unit, target in tag_units:
+                for tag in self.type_tags.containing(unit):
+                    tag_targets[tag] = target
+            if tag_targets:
+                code.extend(
+                    _switch(
+                        bc.Opcode.SWITCH_TAG,
+                        [
+                            tag_targets.get(tag, default)
+                            for tag in range(max(tag_targets) + 1)
+                        ],
+                        default,
+                    )
+                )
             else:
-                # Otherwise make sure it's an object
-                self.append_op(bc.Opcode.IS_VAL_TYPE)
-                self.append_op(bc.ValueType.OBJ.value)
-                with self.condition(True):
-                    if subtype == ts.STR:
-                        # Check for strings with IS_OBJ_TYPE
-                        self.append_op(bc.Opcode.IS_OBJ_TYPE)
-                        self.append_op(bc.ObjectType.STRING.value)
-                        with self.condition(True):
-                            end_true()
-                    if isinstance(subtype, (ts.FunctionType, ts.TupleType)):
-                        # Other types are type tagged structs, make sure it's a struct
-                        self.append_op(bc.Opcode.IS_OBJ_TYPE)
-                        self.append_op(bc.ObjectType.STRUCT.value)
-                        with self.condition(True):
-                            # Check against all the type tags that are contained in the match
-                            for i, tag in enumerate(self.type_tags):
-                                if subtype in tag.units:
-                                    # Get the tag from the struct
-                                    self.append_op(bc.Opcode.EXTRACT_FIELD)
-                                    self.append_op(0)
-                                    self.append_op(0)
-                                    # Compare it
-                                    self.constant(bc.ClrInt(i))
-                                    self.append_op(bc.Opcode.EQUAL)
-                                    with self.condition(True):
-                                        end_true()
-        # If we didn't jump to the end then none of the type checks matched and the result is false
-        # Pop the target value
-        self.append_op(bc.Opcode.POP)
-        # Push the result
-        self.append_op(bc.Opcode.PUSH_FALSE)
-        # End the jumps for true results after the false result
-        for jump in end_jumps:
-            self.end_jump(jump)
+                # No values of the types were ever made
+                code.extend([bc.Opcode.JUMP, bc.Offset(default)])
+        self.code = code
 
     @cx.contextmanager
     def function(
-        self, type_annot: ts.Type, upvalues: List[an.IndexAnnot]
+        self,
+        type_annot: ts.Type,
+        upvalues: List[Tuple[an.IndexAnnot, bool]],
+        name: str,
+        entry: Optional[bc.Label] = None,
     ) -> Iterator[None]:
         """
-        Context manager for creating a type tagged function with upvalues.
+        Context manager for creating a type tagged function with upvalues, given with whether each
+        is copied by value. The name is only used to describe the function, and the entry label if
+        given is placed at the start of its body.
         """
         # Make the function struct, which stores the ip and any upvalues
         # Tagged with the function type
         with self.struct(type_annot, field_count=1 + len(upvalues)):
+            # The function size is the offset to the end of its body
+            end = bc.Label(name)
             self.append_op(bc.Opcode.FUNCTION)
-            idx = len(self.code)
-            # Put a temporary function size argument to be patched after
-            self.append_op(0)
+            self.append_op(bc.Offset(end))
+            if entry is not None:
+                self.append_op(entry)
             yield
-            # Patch the actual function size
-            size = bc.size(self.code[idx + 1 :])
-            self.code[idx] = size
+            self.append_op(end)
             # Load the upvalues to go into the struct above the ip from OP_FUNCTION
-            for ref in upvalues:
-                self.upvalue(ref)
+            for index_annot, copied in upvalues:
+                if copied:
+                    self.load(index_annot)
+                else:
+                    self.upvalue(index_annot)
 
     @cx.contextmanager
     def struct(self, type_annot: ts.Type, field_count: int) -> Iterator[None]:
@@ -142,11 +230,7 @@ class Program:
         Context manager for creating a type tagged struct.
         """
         # Make the type tag index
-        if type_annot in self.type_tags:
-            self.constant(bc.ClrInt(self.type_tags.index(type_annot)))
-        else:
-            self.constant(bc.ClrInt(len(self.type_tags)))
-            self.type_tags.append(type_annot)
+        self.constant(bc.ClrInt(self.type_tags.index(type_annot)))
         yield
         # Make the struct with the given number of fields plus the type tag
         self.append_op(bc.Opcode.STRUCT)
@@ -164,10 +248,10 @@ class Program:
         # End after the skipping jump after the content
         self.end_jump(jump)
 
-    def begin_jump(self, condition: Optional[bool] = None) -> int:
+    def begin_jump(self, condition: Optional[bool] = None) -> bc.Label:
         """
-        Emit a jump instruction, possibly checking for a boolean condition. Returns an index used
-        by end_jump.
+        Emit a jump instruction, possibly checking for a boolean condition. Returns the label to
+        jump to, which is placed by end_jump.
         """
         if condition is None:
             self.append_op(bc.Opcode.JUMP)
@@ -175,32 +259,30 @@ class Program:
             if condition:
                 self.append_op(bc.Opcode.NOT)
             self.append_op(bc.Opcode.JUMP_IF_FALSE)
-        index = len(self.code)
-        self.append_op(0)
-        return index
+        label = bc.Label()
+        self.append_op(bc.Offset(label))
+        return label
 
-    def end_jump(self, index: int) -> None:
+    def end_jump(self, label: bc.Label) -> None:
         """
-        Given an index patches the offset of the jump at that index.
+        Given the label of a jump places it here, so that the jump ends at this instruction.
         """
-        size = bc.size(self.code[index + 1 :])
-        self.code[index] = size
+        self.append_op(label)
 
-    def start_loop(self) -> int:
+    def start_loop(self) -> bc.Label:
         """
-        Begins a loop, returning an index used by loop_back.
+        Begins a loop, returning a label used by loop_back.
         """
-        return len(self.code) - 1
+        label = bc.Label()
+        self.append_op(label)
+        return label
 
-    def loop_back(self, target: int) -> None:
+    def loop_back(self, label: bc.Label) -> None:
         """
-        Given a target index loops back to the instrucion at that index.
+        Given a label loops back to the instruction at that label.
         """
         self.append_op(bc.Opcode.LOOP)
-        index = len(self.code)
-        self.append_op(0)
-        size = bc.size(self.code[target + 1 :])
-        self.code[index] = size
+        self.append_op(bc.Offset(label, backwards=True))
 
     def emit_return(self) -> None:
         """
@@ -237,6 +319,9 @@ class Program:
             # If it's not the function struct deref it
             if index_annot.value != 0:
                 self.append_op(bc.Opcode.DEREF)
+        elif index_annot.kind == an.IndexAnnotType.CAPTURE:
+            # Captured values are stored in the struct directly
+            self.get_upvalue(index_annot.value)
         else:
             self.append_op(bc.Opcode.PUSH_LOCAL)
             self.append_op(index_annot.value)
@@ -270,13 +355,39 @@ class Program:
         if non_void:
             self.append_op(bc.Opcode.PUSH_RETURN)
 
+    def call_direct(self, entry: bc.Label, args: int, non_void: bool) -> None:
+        """
+        Call a function with the given number of args, given the label of its body. The function
+        struct must not be needed, so a placeholder is pushed beneath the arguments instead.
+        """
+        # The function body has already been placed, so it's behind the call
+        self.append_op(bc.Opcode.CALL_DIRECT)
+        self.append_op(bc.Offset(entry, backwards=True))
+        self.append_op(args + 1)
+        if non_void:
+            self.append_op(bc.Opcode.PUSH_RETURN)
+
+    def tail_call(self, args: int) -> None:
+        """
+        Call a function with the given number of args in place of the current function, so that
+        its return is the return of the current function.
+        """
+        # Extract the ip from the function beneath the arguments
+        self.append_op(bc.Opcode.EXTRACT_FIELD)
+        self.append_op(args)
+        self.append_op(1 + 0)
+        # Replace the current frame with the call
+        self.append_op(bc.Opcode.TAIL_CALL)
+        self.append_op(args + 1)
+
     def upvalue(self, index_annot: an.IndexAnnot) -> None:
         """
         Make an upvalue to an index.
         """
-        if index_annot.kind == an.IndexAnnotType.UPVALUE:
+        if index_annot.kind == an.IndexAnnotType.UPVALUE and index_annot.value != 0:
             self.get_upvalue(index_annot.value)
         else:
+            # The recursion upvalue is the function struct, which is local 0
             # Assume that it isn't a global, since globals aren't ever upvalues
             self.append_op(bc.Opcode.REF_LOCAL)
             self.append_op(index_annot.value)
@@ -285,11 +396,12 @@ class Program:
         """
         Load a constant value.
         """
-        if value in self.constants:
-            index = self.constants.index(value)
-        else:
+        key = (type(value), value.unboxed)
+        index = self.constant_indices.get(key)
+        if index is None:
             index = len(self.constants)
             self.constants.append(value)
+            self.constant_indices[key] = index
         self.append_op(bc.Opcode.PUSH_CONST)
         self.append_op(index)
 
@@ -302,6 +414,56 @@ class CodeGenerator(ast.ContextVisitor):
     def __init__(self) -> None:
         super().__init__()
         self.program = Program()
+        self._global_count = 0
+        self._hidden_count = 0
+        # Bindings whose values have been put on the stack so far, since returning before a local
+        # is declared mustn't pop it
+        self._declared: Set[ast.AstName] = set()
+        # Expression statements which are the last thing to run in a function
+        self._tail_stmts: Set[ast.AstExprStmt] = set()
+        # Labels at the start of the bodies of functions that can be called directly
+        self._entries: Dict[ast.AstFuncDecl, bc.Label] = {}
+        # How many functions being generated are hoisted to run before the rest of the program
+        self._hoisted = 0
+
+    def start(self, node: ast.Ast) -> None:
+        self._global_count = node.global_count
+        super().start(node)
+        # Define the hidden globals for builtins and closures before the rest of the program
+        code = self.program.code
+        self.program.code = []
+        for name, index_annot in self.program.builtin_globals.items():
+            self._builtin_function(name)
+            self.program.declare(index_annot)
+        self.program.code.extend(self.program.closure_code)
+        self.program.code.extend(code)
+        self.program.resolve_tag_switches()
+
+    def _hidden_global(self) -> an.IndexAnnot:
+        # Hidden globals go after all the others
+        index_annot = an.IndexAnnot(
+            value=self._global_count + self._hidden_count, kind=an.IndexAnnotType.GLOBAL
+        )
+        self._hidden_count += 1
+        return index_annot
+
+    @cx.contextmanager
+    def _closure(self, node: ast.AstFunction, constant: bool) -> Iterator[None]:
+        # Functions without upvalues are the same every time, so if they could be made more than
+        # once they're made a single time in a hidden global instead
+        if not constant or node.upvalues:
+            yield
+            return
+        index_annot = self._hidden_global()
+        code = self.program.code
+        self.program.code = []
+        self._hoisted += 1
+        yield
+        self._hoisted -= 1
+        self.program.declare(index_annot)
+        self.program.closure_code.extend(self.program.code)
+        self.program.code = code
+        self.program.load(index_annot)
 
     def _return(self, node: ast.AstFuncDecl) -> None:
         # Pop all the names in the function scope
@@ -310,13 +472,39 @@ class CodeGenerator(ast.ContextVisitor):
                 if isinstance(context, ast.AstScope) and not isinstance(
                     context, ast.AstStructDecl
                 ):
-                    for _ in context.names:
-                        self.program.append_op(bc.Opcode.POP)
-        for _ in node.block.names:
-            self.program.append_op(bc.Opcode.POP)
+                    self._pop_declared(context.names)
+        self._pop_declared(node.block.names)
         # Emit the return
         self.program.emit_return()
 
+    def _entry(self, node: ast.AstExpr) -> Optional[bc.Label]:
+        # Get the entry label of the function an expression refers to, if it's known statically.
+        # Direct calls only jump backwards, so can't be made from code placed before every entry.
+        if self._hoisted:
+            return None
+        if isinstance(node, ast.AstIdentExpr) and node.ref is not None:
+            decl = node.ref.dependency
+            if isinstance(decl, ast.AstFuncDecl) and not node.ref.mutated:
+                return self._entries.get(decl)
+        return None
+
+    def _tail_call(self, node: ast.AstExpr) -> bool:
+        # Make a call in tail position reuse the current frame, returning whether it could
+        if not isinstance(node, ast.AstCallExpr) or (
+            isinstance(node.function, ast.AstIdentExpr)
+            and node.function.name in ts.BUILTINS
+        ):
+            return False
+        super().call_expr(node)
+        self.program.tail_call(len(node.args))
+        return True
+
+    def _pop_declared(self, names: Dict[str, ast.AstName]) -> None:
+        # Only pop values already on the stack, although struct names have always been counted
+        for name in names.values():
+            if isinstance(name, ast.AstStructDecl) or name in self._declared:
+                self.program.append_op(bc.Opcode.POP)
+
     @cx.contextmanager
     def decorators(self, decorators: List[ast.AstExpr]) -> Iterator[None]:
         """
@@ -340,17 +528,38 @@ class CodeGenerator(ast.ContextVisitor):
             # Declare all the bindings
             for binding in reversed(node.bindings):
                 self.program.declare(binding.index_annot)
+        self._declared.update(node.bindings)
 
     def func_decl(self, node: ast.AstFuncDecl) -> None:
-        with self.decorators(node.decorators):
-            with self.program.function(node.binding.type_annot, node.upvalue_indices):
+        entry = None
+        if _direct(node):
+            entry = bc.Label(node.binding.name)
+            self._entries[node] = entry
+        # Top level functions are only made once anyway
+        constant = not isinstance(node.context, ast.Ast)
+        with self.decorators(node.decorators), self._closure(node, constant):
+            with self.program.function(
+                node.binding.type_annot,
+                _upvalues(node),
+                name=node.binding.name,
+                entry=entry,
+            ):
                 self._push_context(node)
+                self._declared.update(param.binding for param in node.params)
+                # If the body can reach its end, calls just before the implicit return are in tail
+                # position too
+                if (
+                    node.return_type.type_annot == ts.VOID
+                    and node.block.return_annot != an.ReturnAnnot.ALWAYS
+                ):
+                    self._tail_stmts.update(_ending_stmts(node.block.decls))
                 for decl in node.block.decls:
                     decl.accept(self)
                 self._pop_context()
                 if node.return_type.type_annot == ts.VOID:
                     self._return(node)
         self.program.declare(node.binding.index_annot)
+        self._declared.add(node.binding)
 
     def print_stmt(self, node: ast.AstPrintStmt) -> None:
         if node.expr:
@@ -409,6 +618,8 @@ class CodeGenerator(ast.ContextVisitor):
             run()
 
     def return_stmt(self, node: ast.AstReturnStmt) -> None:
+        if node.expr and self._tail_call(node.expr):
+            return
         if node.expr:
             node.expr.accept(self)
             self.program.append_op(bc.Opcode.SET_RETURN)
@@ -418,6 +629,8 @@ class CodeGenerator(ast.ContextVisitor):
                 break
 
     def expr_stmt(self, node: ast.AstExprStmt) -> None:
+        if node in self._tail_stmts and self._tail_call(node.expr):
+            return
         node.expr.accept(self)
         if node.expr.type_annot != ts.VOID:
             self.program.append_op(bc.Opcode.POP)
@@ -442,27 +655,35 @@ class CodeGenerator(ast.ContextVisitor):
         self.program.constant(bc.ClrStr(node.value))
 
     def ident_expr(self, node: ast.AstIdentExpr) -> None:
-        # TODO: Cache the function if it's used multiple times
         if node.name in ts.BUILTINS:
-            builtin = ts.BUILTINS[node.name]
-            as_func = builtin.type_annot.get_function()
-            if as_func is not None:  # Should be true
-                with self.program.function(builtin.type_annot, upvalues=[]):
-                    # Load all the parameters
-                    for i in range(len(as_func.parameters)):
-                        self.program.append_op(bc.Opcode.PUSH_LOCAL)
-                        self.program.append_op(1 + i)
-                    # Call the builtin
-                    self.program.append_op(builtin.opcode)
-                    # Return
-                    if as_func.return_type != ts.VOID:
-                        self.program.append_op(bc.Opcode.SET_RETURN)
-                    for _ in as_func.parameters:
-                        self.program.append_op(bc.Opcode.POP)
-                    self.program.emit_return()
+            # Builtins used as values are loaded from hidden globals after all the others
+            builtin_globals = self.program.builtin_globals
+            if node.name not in builtin_globals:
+                builtin_globals[node.name] = self._hidden_global()
+            self.program.load(builtin_globals[node.name])
         else:
             self.program.load(node.index_annot)
 
+    def _builtin_function(self, name: str) -> None:
+        builtin = ts.BUILTINS[name]
+        as_func = builtin.type_annot.get_function()
+        if as_func is not None:  # Should be true
+            with self.program.function(
+                builtin.type_annot, upvalues=[], name=f"<builtin {name}>"
+            ):
+                # Load all the parameters
+                for i in range(len(as_func.parameters)):
+                    self.program.append_op(bc.Opcode.PUSH_LOCAL)
+                    self.program.append_op(1 + i)
+                # Call the builtin
+                self.program.append_op(builtin.opcode)
+                # Return
+                if as_func.return_type != ts.VOID:
+                    self.program.append_op(bc.Opcode.SET_RETURN)
+                for _ in as_func.parameters:
+                    self.program.append_op(bc.Opcode.POP)
+                self.program.emit_return()
+
     def bool_expr(self, node: ast.AstBoolExpr) -> None:
         self.program.append_op(
             bc.Opcode.PUSH_TRUE if node.value else bc.Opcode.PUSH_FALSE
@@ -485,13 +706,18 @@ class CodeGenerator(ast.ContextVisitor):
             # Go to the end
             end_jumps.append(self.program.begin_jump())
 
-        for case_type, case_value in node.cases:
-            # Check if the type matches
-            self.program.match_type(node.binding.index_annot, case_type.type_annot)
-            with self.program.condition(True):
-                # If it does use it as the result
-                use_value(case_value)
-        # If we haven't jumped to the end there should be a fallback
+        # Dispatch on the type of the target once to find the matching case
+        targets = [bc.Label() for _ in node.cases]
+        default = bc.Label()
+        self.program.match_types(
+            [case_type.type_annot for case_type, _ in node.cases], targets, default
+        )
+        for target, (_, case_value) in zip(targets, node.cases):
+            # If it matches use it as the result
+            self.program.end_jump(target)
+            use_value(case_value)
+        # If no case matched there should be a fallback
+        self.program.end_jump(default)
         if node.fallback:
             use_value(node.fallback)
         for jump in end_jumps:
@@ -508,11 +734,21 @@ class CodeGenerator(ast.ContextVisitor):
                 arg.accept(self)
             self.program.append_op(builtin.opcode)
         else:
-            # Load the function and arguments
-            super().call_expr(node)
             as_func = node.function.type_annot.get_function()
-            if as_func is not None:  # Should always be true
-                self.program.call(len(node.args), as_func.return_type != ts.VOID)
+            if as_func is None:  # Should never happen
+                return
+            non_void = as_func.return_type != ts.VOID
+            entry = self._entry(node.function)
+            if entry is not None:
+                # Top level functions don't need their function struct loaded
+                self.program.append_op(bc.Opcode.PUSH_NIL)
+                for arg in node.args:
+                    arg.accept(self)
+                self.program.call_direct(entry, len(node.args), non_void)
+            else:
+                # Load the function and arguments
+                super().call_expr(node)
+                self.program.call(len(node.args), non_void)
 
     def tuple_expr(self, node: ast.AstTupleExpr) -> None:
         # Make a struct from all the elements
@@ -520,7 +756,11 @@ class CodeGenerator(ast.ContextVisitor):
             super().tuple_expr(node)
 
     def lambda_expr(self, node: ast.AstLambdaExpr) -> None:
-        with self.program.function(node.type_annot, node.upvalue_indices):
+        with self._closure(node, constant=True), self.program.function(
+            node.type_annot, _upvalues(node), name="<lambda>"
+        ):
+            if self._tail_call(node.value):
+                return
             # Load the value
             node.value.accept(self)
             # Return the value
@@ -583,17 +823,51 @@ class CodeGenerator(ast.ContextVisitor):
         if not node.ref:
             return
         self.program.append_op(bc.Opcode.GET_FIELD)
-        struct = node.ref
-        for param_index, param in enumerate(struct.params):
-            if param.binding.name == node.name:
-                self.program.append_op(1 + param_index)
-                return
-        generator_index = 0
-        for _, bindings in struct.generators:
-            for binding_index, binding in enumerate(bindings):
-                if binding.name == node.name:
-                    self.program.append_op(
-                        1 + len(struct.params) + generator_index + binding_index
-                    )
-                    return
-            generator_index += len(bindings)
+        # Offset by the type tag
+        self.program.append_op(1 + node.ref.slots[node.name])
+
+
+def _switch(
+    opcode: bc.Opcode, targets: List[bc.Label], default: bc.Label
+) -> List[bc.Instruction]:
+    # A switch is followed by the size of its jump table, then an offset for each entry and one
+    # for the default
+    result: List[bc.Instruction] = [opcode, len(targets)]
+    result.extend(bc.Offset(target) for target in targets)
+    result.append(bc.Offset(default))
+    return result
+
+
+def _ending_stmts(decls: List[ast.AstDecl]) -> Iterator[ast.AstExprStmt]:
+    # Find the expression statements that can be the last to run in a list of declarations
+    if not decls:
+        return
+    last = decls[-1]
+    if isinstance(last, ast.AstExprStmt):
+        yield last
+    elif isinstance(last, ast.AstBlockStmt):
+        yield from _ending_stmts(last.decls)
+    elif isinstance(last, ast.AstIfStmt):
+        for _, block in [last.if_part] + last.elif_parts:
+            yield from _ending_stmts(block.decls)
+        if last.else_part:
+            yield from _ending_stmts(last.else_part.decls)
+
+
+def _direct(node: ast.AstFuncDecl) -> bool:
+    # Top level functions have no upvalues and load themselves as globals, so calls to them don't
+    # need the function struct, as long as the binding is the function itself
+    return (
+        isinstance(node.context, ast.Ast)
+        and not node.decorators
+        and not node.upvalues
+        and node.binding.index_annot.kind == an.IndexAnnotType.GLOBAL
+    )
+
+
+def _upvalues(node: ast.AstFunction) -> List[Tuple[an.IndexAnnot, bool]]:
+    # Upvalues that are never set can't be changed by anything else, so don't need a reference
+    return [
+        (index_annot, not upvalue.mutated)
+        for index_annot, upvalue in zip(node.upvalue_indices, node.upvalues)
+    ]
@@ -0,0 +1,186 @@
+"""
+Module defining an ast visitor to remove dead code.
+"""
+
+from typing import Counter, Dict, List, Set, Tuple, Union
+
+import collections as co
+
+import clr.ast as ast
+import clr.annotations as an
+import clr.bytecode as bc
+
+LITERALS = (
+    ast.AstIntExpr,
+    ast.AstNumExpr,
+    ast.AstStrExpr,
+    ast.AstBoolExpr,
+    ast.AstNilExpr,
+)
+
+
+def pure(node: ast.AstExpr) -> bool:
+    """
+    Returns whether evaluating an expression has no effects and can't fail, so that it can be
+    dropped if the value isn't used.
+    """
+    if isinstance(node, LITERALS + (ast.AstIdentExpr, ast.AstLambdaExpr)):
+        return True
+    if isinstance(node, (ast.AstUnaryExpr, ast.AstAccessExpr)):
+        return pure(node.target)
+    if isinstance(node, ast.AstBinaryExpr):
+        # Dividing ints by zero fails at runtime
+        return (
+            bc.Opcode.INT_DIV not in node.opcodes
+            and pure(node.left)
+            and pure(node.right)
+        )
+    if isinstance(node, ast.AstTupleExpr):
+        return all(pure(expr) for expr in node.exprs)
+    if isinstance(node, ast.AstCaseExpr):
+        return (
+            pure(node.target)
+            and all(pure(value) for _, value in node.cases)
+            and (node.fallback is None or pure(node.fallback))
+        )
+    return False
+
+
+class DeadCodeEliminator(ast.DeepVisitor):
+    """
+    Ast visitor to remove unreachable statements, and declarations of values and functions that
+    are never referenced if they can be dropped without changing behaviour.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        # References in the order they're visited, so that the references inside each declaration
+        # are a contiguous range of them
+        self._refs: List[ast.AstBinding] = []
+        self._dead_refs: Set[int] = set()
+        self._counts: Counter[ast.AstBinding] = co.Counter()
+        self._ranges: Dict[ast.AstDecl, Tuple[int, int]] = {}
+        # The list of declarations each declaration is in
+        self._owners: Dict[ast.AstDecl, List[ast.AstDecl]] = {}
+        self._unreachable: List[ast.AstDecl] = []
+        # Declarations that can be removed once their bindings aren't referenced
+        self._removable: Dict[ast.AstBinding, ast.AstNameDecl] = {}
+        # Number of references functions have to themselves
+        self._self_refs: Counter[ast.AstBinding] = co.Counter()
+        self._functions: List[ast.AstFunction] = []
+
+    def _visit_decls(self, decls: List[ast.AstDecl]) -> None:
+        reachable = True
+        for decl in decls:
+            start = len(self._refs)
+            decl.accept(self)
+            self._ranges[decl] = (start, len(self._refs))
+            self._owners[decl] = decls
+            if not reachable:
+                self._unreachable.append(decl)
+            elif decl.return_annot == an.ReturnAnnot.ALWAYS:
+                reachable = False
+            if isinstance(decl, ast.AstValueDecl):
+                if not decl.decorators and pure(decl.val_init):
+                    for binding in decl.bindings:
+                        self._removable[binding] = decl
+            elif isinstance(decl, ast.AstFuncDecl):
+                if not decl.decorators:
+                    self._removable[decl.binding] = decl
+                    self._self_refs[decl.binding] = self._refs[start:].count(
+                        decl.binding
+                    )
+
+    def _unused(self, decl: ast.AstNameDecl) -> bool:
+        if isinstance(decl, ast.AstValueDecl):
+            return all(not self._counts[binding] for binding in decl.bindings)
+        if isinstance(decl, ast.AstFuncDecl):
+            return self._counts[decl.binding] == self._self_refs[decl.binding]
+        return False
+
+    def _remove_refs(
+        self, decl: ast.AstDecl, removed: Set[ast.AstDecl]
+    ) -> List[ast.AstDecl]:
+        # Remove the references inside a declaration, returning declarations made unused by it
+        unused: List[ast.AstDecl] = []
+        start, end = self._ranges[decl]
+        for i in range(start, end):
+            if i in self._dead_refs:
+                continue
+            self._dead_refs.add(i)
+            ref = self._refs[i]
+            self._counts[ref] -= 1
+            owner = self._removable.get(ref)
+            if owner is None or owner in removed:
+                continue
+            if owner is decl or self._ranges[owner][0] <= i < self._ranges[owner][1]:
+                self._self_refs[ref] -= 1
+            if self._unused(owner):
+                unused.append(owner)
+        return unused
+
+    def _eliminate(self) -> None:
+        worklist: List[ast.AstDecl] = list(self._unreachable)
+        worklist.extend(
+            decl for decl in set(self._removable.values()) if self._unused(decl)
+        )
+        removed: Set[ast.AstDecl] = set()
+        while worklist:
+            decl = worklist.pop()
+            if decl in removed:
+                continue
+            removed.add(decl)
+            worklist.extend(self._remove_refs(decl, removed))
+        removed_bindings: Set[ast.AstBinding] = set()
+        # Filter each list of declarations once, keyed by identity since lists aren't hashable
+        owners = {id(self._owners[decl]): self._owners[decl] for decl in removed}
+        for decls in owners.values():
+            decls[:] = [decl for decl in decls if decl not in removed]
+        for decl in removed:
+            if isinstance(decl, (ast.AstValueDecl, ast.AstFuncDecl)):
+                bindings = (
+                    decl.bindings
+                    if isinstance(decl, ast.AstValueDecl)
+                    else [decl.binding]
+                )
+                names = _scope_names(decl)
+                for binding in bindings:
+                    removed_bindings.add(binding)
+                    if names is not None and names.get(binding.name) is binding:
+                        del names[binding.name]
+        # Functions can't capture values that no longer exist
+        for function in self._functions:
+            function.upvalues = [
+                upvalue
+                for upvalue in function.upvalues
+                if upvalue not in removed_bindings
+            ]
+
+    def start(self, node: ast.Ast) -> None:
+        self._visit_decls(node.decls)
+        self._eliminate()
+
+    def block_stmt(self, node: ast.AstBlockStmt) -> None:
+        self._visit_decls(node.decls)
+        self._decl(node)
+
+    def func_decl(self, node: ast.AstFuncDecl) -> None:
+        self._functions.append(node)
+        super().func_decl(node)
+
+    def lambda_expr(self, node: ast.AstLambdaExpr) -> None:
+        self._functions.append(node)
+        super().lambda_expr(node)
+
+    def ident_expr(self, node: ast.AstIdentExpr) -> None:
+        if node.ref:
+            self._refs.append(node.ref)
+            self._counts[node.ref] += 1
+
+
+def _scope_names(decl: ast.AstDecl) -> Union[Dict[str, ast.AstName], None]:
+    if isinstance(decl.context, (ast.Ast, ast.AstBlockStmt)):
+        return decl.context.names
+    if isinstance(decl.context, ast.AstFuncDecl):
+        return decl.context.block.names
+    return None
@@ -2,8 +2,9 @@
 Definitions for compile errors and tracking/displaying them.
 """
 
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
+import bisect
 import enum
 import dataclasses as dc
 
@@ -85,36 +86,60 @@ class IncompatibleSourceError(Exception):
     """
 
 
+@dc.dataclass(eq=False)
+class SourceFile:
+    """
+    Handle for a file of Clear source code. Views into the file refer to the handle itself, so
+    checking whether two views share a source is an identity comparison.
+    """
+
+    text: str = dc.field(repr=False)
+    path: str = ""
+    _lines: Optional["LineIndex"] = dc.field(default=None, init=False, repr=False)
+
+    def lines(self) -> "LineIndex":
+        """
+        Returns the line index of the file, building it the first time it is needed.
+        """
+        if self._lines is None:
+            self._lines = LineIndex(self.text)
+        return self._lines
+
+
 @dc.dataclass
 class SourceView:
     """
-    Represents a region within a Clear source string.
+    Represents a region within a Clear source file.
     """
 
-    source: str
+    source: "SourceFile"
     start: int
     end: int
 
     def __str__(self) -> str:
-        return self.source[self.start : self.end]
+        return self.source.text[self.start : self.end]
 
     def endline(self) -> int:
         """
         Returns the line number of the last line spanned by this region.
         """
-        return 1 + self.source[: self.end].count("\n")
+        return self.source.lines().line(self.end)
 
     def display(self, line_number_width: int) -> str:
         """
         Display the region as a string with line numbers and underlines.
         """
+        lines = self.source.lines()
         # List of (line number, line content, underline)
-        lines: List[Tuple[int, str, str]] = []
-        # Index into the source of the start of the current line
-        index = 0
-        for i, line in enumerate(self.source.splitlines(keepends=True)):
+        display_lines: List[Tuple[int, str, str]] = []
+        # Lines before the one containing the start of the region can be skipped
+        for line_number in range(lines.line(self.start), lines.count() + 1):
+            # Index into the source of the start of the current line
+            index, line = lines.get(line_number)
+            # The empty line after a trailing newline has nothing to display
+            if not line:
+                break
             if self.start < index + len(line):
-                line_number = i + 1
                 # Check if the self starts or ends on this line
                 starts = self.start > index
                 ends = self.end < index + len(line)
@@ -122,25 +147,26 @@ class SourceView:
                 start = self.start - index if starts else 0
                 end = self.end - index if ends else len(line) - 1
                 # Add the information to the list
-                lines.append((line_number, line, " " * start + "~" * (end - start)))
+                display_lines.append(
+                    (line_number, line, " " * start + "~" * (end - start))
+                )
                 # Stop iterating if the error self ended
                 if ends:
                     break
-            index += len(line)
         # Padding for underlines which don't get numbers
         line_number_padding = " " * line_number_width
         return "\n".join(
             f"{line_number:{line_number_width}} | {line}"
             f"{line_number_padding} | {underline}"
-            for line_number, line, underline in lines
+            for line_number, line, underline in display_lines
         )
 
     @staticmethod
-    def all(source: str) -> "SourceView":
+    def all(source: "SourceFile") -> "SourceView":
         """
-        Given a source string returns a view of the entire string.
+        Given a source file returns a view of the entire file.
         """
-        return SourceView(source=source, start=0, end=len(source))
+        return SourceView(source=source, start=0, end=len(source.text))
 
     @staticmethod
     def range(start: "SourceView", end: "SourceView") -> "SourceView":
@@ -148,6 +174,47 @@ class SourceView:
         Takes a start and end view and returns a view of the whole range between them.
         If they view separate sources raises an IncompatibleSourceError.
         """
-        if start.source != end.source:
+        if start.source is not end.source:
             raise IncompatibleSourceError
         return SourceView(source=start.source, start=start.start, end=end.end)
+
+
+class LineIndex:
+    """
+    Table of the offsets where each line of a source string starts, so that line lookups don't
+    need to rescan the source.
+    """
+
+    def __init__(self, source: str) -> None:
+        self.source = source
+        self.starts = [0]
+        line = ""
+        for line in source.splitlines(keepends=True):
+            self.starts.append(self.starts[-1] + len(line))
+        # The end of the source only starts another line if the last line was terminated
+        if line and line.splitlines()[0] == line:
+            self.starts.pop()
+
+    def count(self) -> int:
+        """
+        Returns the number of lines in the source.
+        """
+        return len(self.starts)
+
+    def line(self, offset: int) -> int:
+        """
+        Returns the line number of the line containing an offset into the source.
+        """
+        return bisect.bisect_right(self.starts, offset)
+
+    def get(self, line: int) -> Tuple[int, str]:
+        """
+        Returns the offset of the start of a line and its contents given its line number.
+        """
+        start = self.starts[line - 1]
+        end = self.starts[line] if line < len(self.starts) else len(self.source)
+        return start, self.source[start:end]
+
+
+# Shared source file for placeholder views that don't come from real code
+EMPTY_SOURCE = SourceFile(text="")
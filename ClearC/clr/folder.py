@@ -0,0 +1,254 @@
+"""
+Module defining an ast visitor to fold constant expressions into literals.
+"""
+
+from typing import Any, Callable, Dict, List, Union
+
+import math
+
+import clr.ast as ast
+import clr.bytecode as bc
+import clr.types as ts
+
+# An int, num, str, bool or nil value
+Value = Any
+
+Literal = Union[
+    ast.AstIntExpr, ast.AstNumExpr, ast.AstStrExpr, ast.AstBoolExpr, ast.AstNilExpr
+]
+LITERALS = (
+    ast.AstIntExpr,
+    ast.AstNumExpr,
+    ast.AstStrExpr,
+    ast.AstBoolExpr,
+    ast.AstNilExpr,
+)
+
+# Constants matching the vm
+INT_MIN = -(2 ** 31)
+NUM_PRECISION = 0.0000001
+
+
+class CannotFold(Exception):
+    """
+    Custom exception class raised when a constant expression can't be evaluated at compile time,
+    so has to be left to the vm.
+    """
+
+
+def _wrap(value: int) -> int:
+    # Ints are 32 bit and wrap around on overflow
+    return (value - INT_MIN) % 2 ** 32 + INT_MIN
+
+
+def _finite(value: float) -> float:
+    if not math.isfinite(value):
+        raise CannotFold
+    return value
+
+
+def _int_div(lhs: int, rhs: int) -> int:
+    # Leave errors such as dividing by zero to happen at runtime
+    if rhs == 0 or (lhs == INT_MIN and rhs == -1):
+        raise CannotFold
+    # Division truncates towards zero
+    quotient = abs(lhs) // abs(rhs)
+    return quotient if (lhs < 0) == (rhs < 0) else -quotient
+
+
+def _num_div(lhs: float, rhs: float) -> float:
+    if rhs == 0.0:
+        raise CannotFold
+    return _finite(lhs / rhs)
+
+
+def _str_cat(lhs: str, rhs: str) -> str:
+    result = lhs + rhs
+    if len(result.encode()) > bc.STR_MAX:
+        raise CannotFold
+    return result
+
+
+def _equal(lhs: Value, rhs: Value) -> bool:
+    # Values of different types are never equal, and nums are compared to a precision
+    if type(lhs) is not type(rhs):
+        return False
+    if isinstance(lhs, float) and isinstance(rhs, float):
+        return abs(lhs - rhs) < NUM_PRECISION
+    return bool(lhs == rhs)
+
+
+UNARY_OPCODES: Dict[bc.Instruction, Callable[[Value], Value]] = {
+    bc.Opcode.INT_NEG: lambda a: _wrap(-a),
+    bc.Opcode.NUM_NEG: lambda a: -a,
+    bc.Opcode.NOT: lambda a: not a,
+}
+
+BINARY_OPCODES: Dict[bc.Instruction, Callable[[Value, Value], Value]] = {
+    bc.Opcode.INT_ADD: lambda a, b: _wrap(a + b),
+    bc.Opcode.NUM_ADD: lambda a, b: _finite(a + b),
+    bc.Opcode.INT_SUB: lambda a, b: _wrap(a - b),
+    bc.Opcode.NUM_SUB: lambda a, b: _finite(a - b),
+    bc.Opcode.INT_MUL: lambda a, b: _wrap(a * b),
+    bc.Opcode.NUM_MUL: lambda a, b: _finite(a * b),
+    bc.Opcode.INT_DIV: _int_div,
+    bc.Opcode.NUM_DIV: _num_div,
+    bc.Opcode.STR_CAT: _str_cat,
+    bc.Opcode.INT_LESS: lambda a, b: a < b,
+    bc.Opcode.NUM_LESS: lambda a, b: a < b - NUM_PRECISION,
+    bc.Opcode.INT_GREATER: lambda a, b: a > b,
+    bc.Opcode.NUM_GREATER: lambda a, b: a > b + NUM_PRECISION,
+    bc.Opcode.EQUAL: _equal,
+}
+
+
+def evaluate(operands: List[Value], opcodes: List[bc.Instruction]) -> Value:
+    """
+    Evaluate a sequence of opcodes on a stack of operands the same way the vm would, raising
+    CannotFold if it can't be done at compile time.
+    """
+    stack = list(operands)
+    for opcode in opcodes:
+        if opcode in UNARY_OPCODES:
+            stack.append(UNARY_OPCODES[opcode](stack.pop()))
+        elif opcode in BINARY_OPCODES:
+            rhs = stack.pop()
+            lhs = stack.pop()
+            stack.append(BINARY_OPCODES[opcode](lhs, rhs))
+        else:
+            raise CannotFold
+    return stack.pop()
+
+
+def _value(node: Literal) -> Value:
+    if isinstance(node, ast.AstNilExpr):
+        return None
+    return node.value
+
+
+def _literal(value: Value, node: ast.AstExpr) -> Literal:
+    # Make a literal node for a value to replace the given node
+    result: Literal
+    if isinstance(value, bool):
+        result = ast.AstBoolExpr(literal=str(value).lower(), region=node.region)
+        result.type_annot = ts.BOOL
+    elif isinstance(value, int):
+        result = ast.AstIntExpr(literal=f"{value}i", region=node.region)
+        result.type_annot = ts.INT
+    elif isinstance(value, float):
+        result = ast.AstNumExpr(literal=repr(value), region=node.region)
+        result.type_annot = ts.NUM
+    elif isinstance(value, str):
+        result = ast.AstStrExpr(literal=f'"{value}"', region=node.region)
+        result.type_annot = ts.STR
+    else:
+        result = ast.AstNilExpr(region=node.region)
+        result.type_annot = ts.NIL
+    return result
+
+
+class ConstantFolder(ast.DeepVisitor):
+    """
+    Ast visitor to replace operators applied to literals with the literal result, and references
+    to values that are initialized to a literal and never set with the literal itself.
+    """
+
+    def _fold(self, node: ast.AstExpr) -> ast.AstExpr:
+        if isinstance(node, ast.AstIdentExpr):
+            return self._propagate(node)
+        if isinstance(node, ast.AstUnaryExpr):
+            operands, opcodes = [node.target], node.opcodes
+        elif isinstance(node, ast.AstBinaryExpr):
+            operands, opcodes = [node.left, node.right], node.opcodes
+        else:
+            return node
+        values = []
+        for operand in operands:
+            if not isinstance(operand, LITERALS):
+                return node
+            values.append(_value(operand))
+        try:
+            result = _literal(evaluate(values, opcodes), node)
+        except CannotFold:
+            return node
+        return result if result.type_annot == node.type_annot else node
+
+    def _propagate(self, node: ast.AstIdentExpr) -> ast.AstExpr:
+        ref = node.ref
+        if ref is None or ref.mutated:
+            return node
+        decl = ref.dependency
+        if (
+            not isinstance(decl, ast.AstValueDecl)
+            or decl.decorators
+            or len(decl.bindings) != 1
+            or not isinstance(decl.val_init, LITERALS)
+            or decl.val_init.type_annot != ref.type_annot
+        ):
+            return node
+        return _literal(_value(decl.val_init), node)
+
+    def value_decl(self, node: ast.AstValueDecl) -> None:
+        super().value_decl(node)
+        node.val_init = self._fold(node.val_init)
+
+    def print_stmt(self, node: ast.AstPrintStmt) -> None:
+        super().print_stmt(node)
+        if node.expr:
+            node.expr = self._fold(node.expr)
+
+    def set_stmt(self, node: ast.AstSetStmt) -> None:
+        super().set_stmt(node)
+        node.value = self._fold(node.value)
+
+    def if_stmt(self, node: ast.AstIfStmt) -> None:
+        super().if_stmt(node)
+        cond, block = node.if_part
+        node.if_part = (self._fold(cond), block)
+        node.elif_parts = [(self._fold(cond), block) for cond, block in node.elif_parts]
+
+    def while_stmt(self, node: ast.AstWhileStmt) -> None:
+        super().while_stmt(node)
+        if node.cond:
+            node.cond = self._fold(node.cond)
+
+    def return_stmt(self, node: ast.AstReturnStmt) -> None:
+        super().return_stmt(node)
+        if node.expr:
+            node.expr = self._fold(node.expr)
+
+    def expr_stmt(self, node: ast.AstExprStmt) -> None:
+        super().expr_stmt(node)
+        node.expr = self._fold(node.expr)
+
+    def unary_expr(self, node: ast.AstUnaryExpr) -> None:
+        super().unary_expr(node)
+        node.target = self._fold(node.target)
+
+    def binary_expr(self, node: ast.AstBinaryExpr) -> None:
+        super().binary_expr(node)
+        node.left = self._fold(node.left)
+        node.right = self._fold(node.right)
+
+    def case_expr(self, node: ast.AstCaseExpr) -> None:
+        super().case_expr(node)
+        node.target = self._fold(node.target)
+        node.cases = [(case_type, self._fold(value)) for case_type, value in node.cases]
+        if node.fallback:
+            node.fallback = self._fold(node.fallback)
+
+    def call_expr(self, node: ast.AstCallExpr) -> None:
+        super().call_expr(node)
+        node.args = [self._fold(arg) for arg in node.args]
+
+    def tuple_expr(self, node: ast.AstTupleExpr) -> None:
+        super().tuple_expr(node)
+        node.exprs = [self._fold(expr) for expr in node.exprs]
+
+    def lambda_expr(self, node: ast.AstLambdaExpr) -> None:
+        super().lambda_expr(node)
+        node.value = self._fold(node.value)
+
+    def construct_expr(self, node: ast.AstConstructExpr) -> None:
+        super().construct_expr(node)
+        node.inits = [(label, self._fold(value)) for label, value in node.inits]
@@ -2,8 +2,9 @@
 Module defining a visitor to index identifiers of an ast.
 """
 
-from typing import List, Iterator
+from typing import DefaultDict, Dict, List, Iterator, Set
 
+import collections as co
 import contextlib as cx
 
 import clr.ast as ast
@@ -17,40 +18,50 @@ class UpvalueTracker(ast.ContextVisitor):
 
     def __init__(self) -> None:
         super().__init__()
-        self._global_refs: List[ast.AstBinding] = []
+        self._global_refs: Set[ast.AstBinding] = set()
+        self._upvalue_sets: DefaultDict[
+            ast.AstFunction, Set[ast.AstBinding]
+        ] = co.defaultdict(set)
 
     def start(self, node: ast.Ast) -> None:
         for decl in node.decls:
             if isinstance(decl, ast.AstValueDecl):
                 for binding in decl.bindings:
-                    self._global_refs.append(binding)
+                    self._global_refs.add(binding)
             elif isinstance(decl, ast.AstFuncDecl):
-                self._global_refs.append(decl.binding)
-            decl.accept(self)
+                self._global_refs.add(decl.binding)
+        super().start(node)
 
     def ident_expr(self, node: ast.AstIdentExpr) -> None:
+        super().ident_expr(node)
         if node.ref:
             # Globals can always be referenced directly
             if node.ref in self._global_refs:
                 return
             # Find all the functions between the declaration and the reference
             functions = []
+            # Names are keyed by their own name, so looking that up finds the ref if it's declared
+            name = node.ref.name
             for context in reversed(self._contexts):
+                # Functions refer to themselves through the recursion upvalue
+                if isinstance(context, ast.AstFuncDecl) and context.binding is node.ref:
+                    break
                 if (
                     isinstance(context, ast.AstScope)
-                    and node.ref in context.names.values()
+                    and context.names.get(name) is node.ref
                 ):
                     break
                 if (
                     isinstance(context, ast.AstFuncDecl)
-                    and node.ref in context.block.names.values()
+                    and context.block.names.get(name) is node.ref
                 ):
                     break
                 if isinstance(context, ast.AstFunction):
                     functions.append(context)
             # Add it as an upvalue to any such functions
             for function in functions:
-                if node.ref not in function.upvalues:
+                if node.ref not in self._upvalue_sets[function]:
+                    self._upvalue_sets[function].add(node.ref)
                     function.upvalues.append(node.ref)
 
 
@@ -80,9 +91,17 @@ class IndexBuilder(ast.ContextVisitor):
                 base_stack = self._frames[-1]
             self._name_counts.append(base_names)
             self._frames.append(base_stack)
+        if isinstance(context, ast.Ast):
+            # Globals don't depend on the stack, so top level functions are indexed first for any
+            # body to refer to them, including those of mutually recursive functions before them
+            for decl in context.decls:
+                if isinstance(decl, ast.AstFuncDecl):
+                    decl.binding.index_annot = self._make_index()
 
     def _pop_context(self) -> ast.AstContext:
         context = super()._pop_context()
+        if isinstance(context, ast.Ast):
+            context.global_count = self._name_counts[-1]
         if isinstance(context, (ast.AstFunction, ast.AstScope)):
             self._name_counts.pop()
             self._frames.pop()
@@ -127,16 +146,18 @@ class IndexBuilder(ast.ContextVisitor):
         self._decl(node)
 
     def func_decl(self, node: ast.AstFuncDecl) -> None:
+        # Top level functions have already been indexed, but struct generators haven't
+        is_top_level = isinstance(self._get_context(), ast.Ast)
         with self._stack(0):
             for decorator in node.decorators:
                 decorator.accept(self)
             self._push_context(node)
             for param in node.params:
                 param.accept(self)
-            for decl in node.block.decls:
-                decl.accept(self)
+            node.block.accept(self)
             self._pop_context()
-        node.binding.accept(self)
+        if not is_top_level:
+            node.binding.accept(self)
         self._decl(node)
 
     def print_stmt(self, node: ast.AstPrintStmt) -> None:
@@ -227,31 +248,51 @@ class IndexWriter(ast.ContextVisitor):
     Ast visitor to annotate the indices of name references.
     """
 
+    def __init__(self) -> None:
+        super().__init__()
+        # Upvalue indices of each function currently being visited
+        self._upvalue_slots: Dict[ast.AstFunction, Dict[ast.AstBinding, int]] = {}
+
     def _load(self, ref: ast.AstBinding) -> an.IndexAnnot:
+        # Globals are always loaded directly, even by functions referring to themselves, so that
+        # top level functions don't need their function struct when called
+        if ref.index_annot.kind == an.IndexAnnotType.GLOBAL:
+            return ref.index_annot
         for context in reversed(self._contexts):
             if isinstance(context, ast.AstFunction):
                 function = context
                 break
         else:
             return ref.index_annot
-        if ref == function:
+        if isinstance(function, ast.AstFuncDecl) and ref is function.binding:
             # It's the recursion upvalue
             return an.IndexAnnot(value=0, kind=an.IndexAnnotType.UPVALUE)
-        if ref in function.upvalues:
-            # It's a normal upvalue
-            return an.IndexAnnot(
-                value=1 + function.upvalues.index(ref), kind=an.IndexAnnotType.UPVALUE
+        slots = self._upvalue_slots[function]
+        if ref in slots:
+            # It's a normal upvalue, which can be copied by value if it never changes
+            kind = (
+                an.IndexAnnotType.UPVALUE if ref.mutated else an.IndexAnnotType.CAPTURE
             )
+            return an.IndexAnnot(value=slots[ref], kind=kind)
         return ref.index_annot
 
+    def _push_context(self, context: ast.AstContext) -> None:
+        super()._push_context(context)
+        if isinstance(context, ast.AstFunction):
+            self._upvalue_slots[context] = {
+                upvalue: 1 + i for i, upvalue in enumerate(context.upvalues)
+            }
+
     def _pop_context(self) -> ast.AstContext:
         context = super()._pop_context()
         if isinstance(context, ast.AstFunction):
+            del self._upvalue_slots[context]
             context.upvalue_indices = [
                 self._load(upvalue) for upvalue in context.upvalues
             ]
         return context
 
     def ident_expr(self, node: ast.AstIdentExpr) -> None:
+        super().ident_expr(node)
         if node.ref:
             node.index_annot = self._load(node.ref)
@@ -1,9 +1,10 @@
 """
-Contains functions and definitions for lexing Clear code into a list of tokens.
+Contains functions and definitions for lexing Clear code into a stream of tokens.
 """
 
-from typing import List, Iterable, Optional, Tuple
+from typing import List, Iterable, Iterator, Optional, Tuple, Dict
 
+import array
 import enum
 import re
 import dataclasses as dc
@@ -11,82 +12,12 @@ import dataclasses as dc
 import clr.errors as er
 
 
-def tokenize_source(source: str) -> Tuple[List["Token"], List[er.CompileError]]:
+def stream_source(source: er.SourceFile, errors: er.ErrorTracker) -> "TokenStream":
     """
-    Given a string of Clear source code, lexes it into a list of tokens.
+    Given a file of Clear source code, returns a stream of tokens that is lazily lexed from it.
+    Unexpected tokens are added to the given error tracker instead of the stream.
     """
-    skip_rules = [r"//.*", r"\s+"]
-    consume_rules = [
-        (r"[a-zA-Z_][a-zA-Z0-9_]*", TokenType.IDENTIFIER),
-        (r"[0-9]+i", TokenType.INT_LITERAL),
-        (r"[0-9]+(\.[0-9]+)?", TokenType.NUM_LITERAL),
-        (r"\".*?\"", TokenType.STR_LITERAL),
-        (r"==", TokenType.DOUBLE_EQUALS),
-        (r"!=", TokenType.NOT_EQUALS),
-        (r"<=", TokenType.LESS_EQUALS),
-        (r"<", TokenType.LESS),
-        (r">=", TokenType.GREATER_EQUALS),
-        (r">", TokenType.GREATER),
-        (r"=", TokenType.EQUALS),
-        (r",", TokenType.COMMA),
-        (r";", TokenType.SEMICOLON),
-        (r":", TokenType.COLON),
-        (r"\|", TokenType.VERT),
-        (r"{", TokenType.LEFT_BRACE),
-        (r"}", TokenType.RIGHT_BRACE),
-        (r"\(", TokenType.LEFT_PAREN),
-        (r"\)", TokenType.RIGHT_PAREN),
-        (r"\?", TokenType.QUESTION_MARK),
-        (r"\+", TokenType.PLUS),
-        (r"-", TokenType.MINUS),
-        (r"\*", TokenType.STAR),
-        (r"/", TokenType.SLASH),
-        (r"\.", TokenType.DOT),
-        (r"@", TokenType.AT),
-    ]
-    fallback_rule = (r".", TokenType.ERROR)
-
-    lexer = Lexer(source)
-    lexer.run(consume_rules, skip_rules, fallback_rule)
-
-    def keywordize(token: "Token") -> "Token":
-        keyword_set = {
-            TokenType.VAL,
-            TokenType.FUNC,
-            TokenType.VOID,
-            TokenType.IF,
-            TokenType.ELSE,
-            TokenType.WHILE,
-            TokenType.RETURN,
-            TokenType.PRINT,
-            TokenType.OR,
-            TokenType.AND,
-            TokenType.TRUE,
-            TokenType.NIL,
-            TokenType.FALSE,
-            TokenType.AS,
-            TokenType.CASE,
-            TokenType.STRUCT,
-            TokenType.THIS,
-            TokenType.SET,
-        }
-
-        keywords = {keyword.value: keyword for keyword in keyword_set}
-
-        if token.kind == TokenType.IDENTIFIER:
-            lexeme = str(token.lexeme)
-            if lexeme in keywords:
-                token.kind = keywords[lexeme]
-        return token
-
-    return (
-        [keywordize(token) for token in lexer.tokens if token.kind != TokenType.ERROR],
-        [
-            er.CompileError(message=f"unexpected token {token}", regions=[token.lexeme])
-            for token in lexer.tokens
-            if token.kind == TokenType.ERROR
-        ],
-    )
+    return TokenStream(source, errors)
 
 
 @enum.unique
@@ -162,69 +93,186 @@ class Token:
         return str(self.lexeme)
 
 
+class Scanner:
+    """
+    Class for a set of lexing rules compiled into a single alternation of named groups, so that
+    each token or skipped region is found with one match at an offset into the source.
+    """
+
+    def __init__(
+        self,
+        consume_rules: Iterable[Tuple[str, TokenType]] = (),
+        skip_rules: Iterable[str] = (),
+        fallback: Optional[Tuple[str, TokenType]] = None,
+    ) -> None:
+        # Alternation is ordered, so the first rule to match wins as if each were tried in turn
+        rules: List[Tuple[str, Optional[TokenType]]] = [
+            (pattern, None) for pattern in skip_rules
+        ]
+        rules.extend(consume_rules)
+        if fallback is not None:
+            rules.append(fallback)
+        # Map each group name to the kind of token to emit, or None if the match is skipped
+        self.kinds: Dict[Optional[str], Optional[TokenType]] = {}
+        groups = []
+        for i, (pattern, kind) in enumerate(rules):
+            name = f"rule{i}"
+            self.kinds[name] = kind
+            groups.append(f"(?P<{name}>{pattern})")
+        self.pattern = re.compile("|".join(groups))
+
+
 @dc.dataclass
 class Lexer:
     """
-    Class for walking over a source string and emitting tokens or skipping based on regex patterns.
+    Class for walking over a source file and emitting tokens or skipping based on a scanner.
     """
 
-    source: str
+    source: er.SourceFile
     cursor: int = 0
-    tokens: List[Token] = dc.field(default_factory=list)
 
     def done(self) -> bool:
         """
         Returns whether the source has been fully used up or not.
         """
-        return self.cursor == len(self.source)
+        return self.cursor == len(self.source.text)
 
-    def consume(self, pattern: str, kind: TokenType) -> bool:
+    def spans(self, scanner: Scanner) -> Iterator[Tuple[TokenType, int, int]]:
         """
-        Check if the pattern is matched, and if it is emit it as a token and move after it.
-        Returns whether the match was found.
+        Given a scanner, lazily loops over the source matching its rules and yields the kind, start
+        and end of each emitted token, until reaching the end or reaching something it can't
+        consume.
         """
-        match = re.match(pattern, self.source[self.cursor :])
-        if match:
-            literal = match.group(0)
+        match = scanner.pattern.match
+        kinds = scanner.kinds
+        source = self.source.text
+        length = len(source)
+        while self.cursor < length:
+            found = match(source, self.cursor)
+            if found is None:
+                break
+            start = self.cursor
+            self.cursor = found.end()
+            kind = kinds[found.lastgroup]
+            if kind is not None:
+                yield kind, start, self.cursor
+
+
+class TokenStream:
+    """
+    Class for a compact stream of tokens lazily lexed from a source file. The kinds and offsets
+    of tokens are stored in arrays, and Token objects are only built when the stream is indexed.
+    """
+
+    def __init__(self, source: er.SourceFile, errors: er.ErrorTracker) -> None:
+        self.source = source
+        self.errors = errors
+        self.kinds = array.array("B")
+        self.starts = array.array("I")
+        self.ends = array.array("I")
+        self._spans = Lexer(source).spans(SCANNER)
+        self._view: Optional[Token] = None
+        self._view_index = 0
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __getitem__(self, index: int) -> Token:
+        # The parser tends to ask for the same token several times in a row
+        if index != self._view_index or self._view is None:
             lexeme = er.SourceView(
-                source=self.source, start=self.cursor, end=self.cursor + len(literal)
+                source=self.source, start=self.starts[index], end=self.ends[index]
             )
-            self.tokens.append(Token(kind=kind, lexeme=lexeme))
-            self.cursor += len(literal)
-            return True
-        return False
+            self._view = Token(kind=TOKEN_KINDS[self.kinds[index]], lexeme=lexeme)
+            self._view_index = index
+        return self._view
 
-    def skip(self, pattern: str) -> bool:
+    def fill(self, count: int) -> bool:
         """
-        Check if the pattern is matched, and if it is move after it while leaving the start of
-        the region before, so that the next consumed token will include this skipped region.
-        Returns whether the match was found.
+        Lexes more of the source until at least the given number of tokens are stored. Returns
+        whether there were enough tokens in the source to do so.
         """
-        match = re.match(pattern, self.source[self.cursor :])
-        if match:
-            literal = match.group(0)
-            self.cursor += len(literal)
-            return True
-        return False
-
-    def run(
-        self,
-        consume_rules: Iterable[Tuple[str, TokenType]] = (),
-        skip_rules: Iterable[str] = (),
-        fallback: Optional[Tuple[str, TokenType]] = None,
-    ) -> None:
+        while len(self.kinds) < count:
+            span = next(self._spans, None)
+            if span is None:
+                return False
+            kind, start, end = span
+            if kind == TokenType.ERROR:
+                lexeme = er.SourceView(source=self.source, start=start, end=end)
+                self.errors.add(message=f"unexpected token {lexeme}", regions=[lexeme])
+                continue
+            if kind == TokenType.IDENTIFIER:
+                kind = KEYWORDS.get(self.source.text[start:end], kind)
+            self.kinds.append(TOKEN_CODES[kind])
+            self.starts.append(start)
+            self.ends.append(end)
+        return True
+
+    def finish(self) -> None:
         """
-        Given an optional iterable of patterns to consume to token types, an optional iterable of
-        patterns to skip, and an optional fallback pattern to consume to a fallback token type,
-        loops over the source with these rules until reaching the end, or until reaching something
-        it can't consume.
+        Lexes the rest of the source.
         """
-        while not self.done():
-            if (
-                not any(self.skip(pattern) for pattern in skip_rules)
-                and not any(
-                    self.consume(pattern, kind) for pattern, kind in consume_rules
-                )
-                and (fallback is None or not self.consume(*fallback))
-            ):
-                break
+        while self.fill(len(self.kinds) + 1):
+            pass
+
+
+SCANNER = Scanner(
+    consume_rules=[
+        (r"[a-zA-Z_][a-zA-Z0-9_]*", TokenType.IDENTIFIER),
+        (r"[0-9]+i", TokenType.INT_LITERAL),
+        (r"[0-9]+(?:\.[0-9]+)?", TokenType.NUM_LITERAL),
+        (r"\".*?\"", TokenType.STR_LITERAL),
+        (r"==", TokenType.DOUBLE_EQUALS),
+        (r"!=", TokenType.NOT_EQUALS),
+        (r"<=", TokenType.LESS_EQUALS),
+        (r"<", TokenType.LESS),
+        (r">=", TokenType.GREATER_EQUALS),
+        (r">", TokenType.GREATER),
+        (r"=", TokenType.EQUALS),
+        (r",", TokenType.COMMA),
+        (r";", TokenType.SEMICOLON),
+        (r":", TokenType.COLON),
+        (r"\|", TokenType.VERT),
+        (r"{", TokenType.LEFT_BRACE),
+        (r"}", TokenType.RIGHT_BRACE),
+        (r"\(", TokenType.LEFT_PAREN),
+        (r"\)", TokenType.RIGHT_PAREN),
+        (r"\?", TokenType.QUESTION_MARK),
+        (r"\+", TokenType.PLUS),
+        (r"-", TokenType.MINUS),
+        (r"\*", TokenType.STAR),
+        (r"/", TokenType.SLASH),
+        (r"\.", TokenType.DOT),
+        (r"@", TokenType.AT),
+    ],
+    skip_rules=[r"//.*", r"\s+"],
+    fallback=(r".", TokenType.ERROR),
+)
+
+# Compact codes for token types to store them in arrays
+TOKEN_KINDS = list(TokenType)
+TOKEN_CODES = {kind: code for code, kind in enumerate(TOKEN_KINDS)}
+
+KEYWORDS = {
+    keyword.value: keyword
+    for keyword in [
+        TokenType.VAL,
+        TokenType.FUNC,
+        TokenType.VOID,
+        TokenType.IF,
+        TokenType.ELSE,
+        TokenType.WHILE,
+        TokenType.RETURN,
+        TokenType.PRINT,
+        TokenType.OR,
+        TokenType.AND,
+        TokenType.TRUE,
+        TokenType.NIL,
+        TokenType.FALSE,
+        TokenType.AS,
+        TokenType.CASE,
+        TokenType.STRUCT,
+        TokenType.THIS,
+        TokenType.SET,
+    ]
+}
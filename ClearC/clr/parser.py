@@ -1,10 +1,9 @@
 """
-Contains functions and definitions for parsing a list of tokens into a parse tree.
+Contains functions and definitions for parsing a stream of tokens into a parse tree.
 """
 
 from typing import (
     List,
-    Sequence,
     Iterable,
     Optional,
     Union,
@@ -21,33 +20,37 @@ import collections
 import clr.errors as er
 import clr.lexer as lx
 import clr.ast as ast
+import clr.bytecode as bc
 
 
 T = TypeVar("T")  # pylint: disable=invalid-name
 Result = Union[T, er.CompileError]
 
 
-def parse_tokens(tokens: Sequence[lx.Token]) -> Result[ast.Ast]:
+def parse_tokens(tokens: lx.TokenStream) -> Result[ast.Ast]:
     """
-    Parses an ast from a list of tokens.
+    Parses an ast from a stream of tokens.
     """
     return parse_ast(Parser(tokens))
 
 
 class Parser:
     """
-    A wrapper class for parsing a list of tokens.
+    A wrapper class for parsing a stream of tokens. The stream is lexed on demand as the parser
+    looks ahead, and token types are checked directly against the stream's arrays.
     """
 
-    def __init__(self, tokens: Sequence[lx.Token]) -> None:
+    def __init__(self, tokens: lx.TokenStream) -> None:
         self.tokens = tokens
         self.current = 0
 
     def done(self) -> bool:
         """
-        Returns whether the whole token list has been consumed.
+        Returns whether the whole token stream has been consumed.
         """
-        return self.current == len(self.tokens)
+        return self.current >= len(self.tokens.kinds) and not self.tokens.fill(
+            self.current + 1
+        )
 
     def prev(self) -> lx.Token:
         """
@@ -75,19 +78,20 @@ class Parser:
         """
         Checks if the current token is of a given type.
         """
-        curr = self.curr()
-        if curr:
-            return curr.kind == kind
-        return False
+        if self.done():
+            return False
+        return lx.TOKEN_KINDS[self.tokens.kinds[self.current]] is kind
 
     def check_all(self, pattern: List[lx.TokenType]) -> bool:
         """
         Checks to see if the current and following tokens match a list of types.
         """
-        if self.current + len(pattern) >= len(self.tokens):
+        if not self.tokens.fill(self.current + len(pattern) + 1):
             return False
-        match_tokens = self.tokens[self.current : self.current + len(pattern)]
-        return [token.kind for token in match_tokens] == pattern
+        return all(
+            lx.TOKEN_KINDS[self.tokens.kinds[self.current + i]] is kind
+            for i, kind in enumerate(pattern)
+        )
 
     def match(self, kind: lx.TokenType) -> bool:
         """
@@ -127,6 +131,8 @@ def parse_ast(parser: Parser) -> Result[ast.Ast]:
         if isinstance(decl, er.CompileError):
             return decl
         decls.append(decl)
+    if not decls:
+        return ast.Ast(decls=decls)
     return ast.Ast(
         decls=decls, region=er.SourceView.range(decls[0].region, decls[-1].region)
     )
@@ -956,7 +962,7 @@ def finish_int_expr(parser: Parser) -> Result[ast.AstExpr]:
         return er.CompileError(
             message="literal value is too large", regions=[token.lexeme]
         )
-    return ast.AstIntExpr(literal=token)
+    return ast.AstIntExpr(literal=str(token), region=token.lexeme)
 
 
 def finish_num_expr(parser: Parser) -> Result[ast.AstExpr]:
@@ -972,7 +978,7 @@ def finish_num_expr(parser: Parser) -> Result[ast.AstExpr]:
                 message="too many decimal palces, precision up to only 7 is supported",
                 regions=[token.lexeme],
             )
-    return ast.AstNumExpr(literal=token)
+    return ast.AstNumExpr(literal=str(token), region=token.lexeme)
 
 
 def finish_str_expr(parser: Parser) -> Result[ast.AstExpr]:
@@ -981,11 +987,13 @@ def finish_str_expr(parser: Parser) -> Result[ast.AstExpr]:
     already been consumed.
     """
     token = parser.prev()
-    if len(str(token)) > 512 + 2:
+    # The literal is stored as a str constant, so its encoding without quotes has to fit
+    if len(str(token)[1:-1].encode()) > bc.STR_MAX:
         return er.CompileError(
-            message="string literal too long, max length is 512", regions=[token.lexeme]
+            message=f"string literal too long, max length is {bc.STR_MAX} bytes",
+            regions=[token.lexeme],
         )
-    return ast.AstStrExpr(literal=token)
+    return ast.AstStrExpr(literal=str(token), region=token.lexeme)
 
 
 def finish_ident_expr(parser: Parser) -> Result[ast.AstExpr]:
@@ -1029,7 +1037,8 @@ def finish_bool_expr(parser: Parser) -> Result[ast.AstExpr]:
     Parse a bool expression from the parser or return an error. Assumes that the literal token has
     already been consumed.
     """
-    return ast.AstBoolExpr(literal=parser.prev())
+    token = parser.prev()
+    return ast.AstBoolExpr(literal=str(token), region=token.lexeme)
 
 
 def finish_nil_expr(parser: Parser) -> Result[ast.AstExpr]:
@@ -1037,7 +1046,7 @@ def finish_nil_expr(parser: Parser) -> Result[ast.AstExpr]:
     Parse a nil expression from the parser or return an error. Assumes that the literal token has
     already been consumed.
     """
-    return ast.AstNilExpr(literal=parser.prev())
+    return ast.AstNilExpr(region=parser.prev().lexeme)
 
 
 @enum.unique
@@ -0,0 +1,201 @@
+"""
+Module defining a pass manager for the semantic passes, which fuses passes into shared walks of the
+ast where their dependencies allow it.
+"""
+
+from typing import FrozenSet, List, Optional, Type
+
+import dataclasses as dc
+
+import clr.ast as ast
+import clr.resolver as rs
+import clr.sequencer as sq
+import clr.typechecker as tc
+import clr.folder as fo
+import clr.flowchecker as fc
+import clr.eliminator as el
+import clr.indexer as ix
+
+
+@dc.dataclass(frozen=True)
+class Pass:
+    """
+    Class describing a semantic pass for the pass manager. Passes sharing a walk are combined by
+    inheriting from all of their visitors, so apart from the pass driving the walk each visitor
+    must call super() from every visit method it overrides.
+    """
+
+    visitor: Type[ast.DeepVisitor]
+    # Name that errors from the pass are reported under, or None if it never reports errors
+    name: Optional[str] = None
+    # Annotations that must be complete across the whole ast before the pass starts
+    needs: FrozenSet[str] = frozenset()
+    # Annotations that are only read from nodes being visited, so can come from a pass earlier in
+    # the same walk
+    uses: FrozenSet[str] = frozenset()
+    provides: FrozenSet[str] = frozenset()
+    # Whether the pass chooses its own traversal order instead of only adding work to each node
+    drives: bool = False
+    # Whether the pass can share a walk with other passes at all
+    fusable: bool = True
+
+
+@dc.dataclass
+class PassGroup:
+    """
+    Class for a group of passes which run together in a single walk of the ast.
+    """
+
+    passes: List[Pass]
+    visitor: Type[ast.DeepVisitor]
+
+    def name(self) -> str:
+        """
+        Returns the name that errors from the group are reported under.
+        """
+        for member in self.passes:
+            if member.name is not None:
+                return member.name
+        return "Semantic"
+
+    def make_visitor(self) -> ast.DeepVisitor:
+        """
+        Creates a visitor running every pass in the group.
+        """
+        return self.visitor()
+
+    def fuse(self, new: Pass) -> Optional["PassGroup"]:
+        """
+        Returns a group which also runs the given pass in the same walk, or None if it can't.
+        """
+        if not new.fusable or not all(member.fusable for member in self.passes):
+            return None
+        # Needed annotations must be complete before the walk starts
+        if any(member.provides & new.needs for member in self.passes):
+            return None
+        # Errors from each name are reported before starting passes that report other errors
+        if new.name is not None and any(
+            member.name not in (None, new.name) for member in self.passes
+        ):
+            return None
+        if new.drives and any(member.drives for member in self.passes):
+            return None
+        passes = self.passes + [new]
+        visitor = _fused_visitor(passes)
+        if visitor is None:
+            return None
+        return PassGroup(passes=passes, visitor=visitor)
+
+
+def _fused_visitor(passes: List[Pass]) -> Optional[Type[ast.DeepVisitor]]:
+    # The driving pass goes last so that the others' calls to super() reach its traversal
+    visitors = [member.visitor for member in passes if not member.drives] + [
+        member.visitor for member in passes if member.drives
+    ]
+    try:
+        fused = type("FusedVisitor", tuple(visitors), {})
+    except TypeError:
+        return None
+    # Every pass has to come before the base visitors, or the base traversal would cut it off
+    mro = fused.mro()
+    if any(
+        mro.index(visitor) > mro.index(base)
+        for visitor in visitors
+        for base in (ast.ContextVisitor, ast.DeepVisitor)
+        if base in mro
+    ):
+        return None
+    return fused
+
+
+def plan_passes(passes: List[Pass]) -> List[PassGroup]:
+    """
+    Given a list of passes in order, groups consecutive passes into as few walks as possible.
+    """
+    groups: List[PassGroup] = []
+    for new in passes:
+        fused = groups[-1].fuse(new) if groups else None
+        if fused is None:
+            groups.append(PassGroup(passes=[new], visitor=new.visitor))
+        else:
+            groups[-1] = fused
+    return groups
+
+
+def separate_passes(passes: List[Pass]) -> List[PassGroup]:
+    """
+    Given a list of passes in order, gives each pass a walk of its own so that it can be measured
+    on its own.
+    """
+    return [PassGroup(passes=[new], visitor=new.visitor) for new in passes]
+
+
+SEMANTIC_PASSES = [
+    Pass(rs.DuplicateChecker, name="Resolve"),
+    Pass(rs.NameTracker, name="Resolve", provides=frozenset({"names", "contexts"})),
+    Pass(
+        rs.NameResolver,
+        name="Resolve",
+        needs=frozenset({"names"}),
+        provides=frozenset({"refs", "mutations"}),
+    ),
+    # Follows references out of order, so no other pass can share its walk
+    Pass(
+        sq.SequenceBuilder,
+        name="Sequencing",
+        needs=frozenset({"refs", "contexts"}),
+        provides=frozenset({"sequence"}),
+        fusable=False,
+    ),
+    Pass(
+        sq.SequenceWriter, needs=frozenset({"sequence"}), provides=frozenset({"order"})
+    ),
+    Pass(
+        tc.TypeChecker,
+        name="Type",
+        needs=frozenset({"refs"}),
+        uses=frozenset({"order"}),
+        provides=frozenset({"types"}),
+        drives=True,
+    ),
+    Pass(
+        fo.ConstantFolder,
+        needs=frozenset({"refs", "mutations"}),
+        uses=frozenset({"types"}),
+        provides=frozenset({"folds"}),
+    ),
+    Pass(
+        ix.UpvalueTracker,
+        needs=frozenset({"names", "refs"}),
+        uses=frozenset({"order"}),
+        provides=frozenset({"upvalues"}),
+    ),
+    Pass(
+        fc.FlowChecker,
+        name="Control Flow",
+        needs=frozenset({"types"}),
+        provides=frozenset({"returns"}),
+    ),
+    Pass(
+        el.DeadCodeEliminator,
+        needs=frozenset({"refs", "folds", "upvalues"}),
+        uses=frozenset({"returns"}),
+        provides=frozenset({"eliminated"}),
+        drives=True,
+    ),
+    Pass(
+        ix.IndexBuilder,
+        needs=frozenset({"order", "eliminated"}),
+        provides=frozenset({"indices"}),
+        drives=True,
+    ),
+    Pass(
+        ix.IndexWriter,
+        needs=frozenset({"upvalues"}),
+        uses=frozenset({"indices"}),
+        provides=frozenset({"loads"}),
+    ),
+]
+
+SEMANTIC_PIPELINE = plan_passes(SEMANTIC_PASSES)
+SEPARATE_PIPELINE = separate_passes(SEMANTIC_PASSES)
@@ -0,0 +1,192 @@
+"""
+Module for a peephole optimiser, which removes redundant instructions from generated code before
+it is assembled.
+"""
+
+from typing import Dict, List, Optional, Tuple, Union
+
+import dataclasses as dc
+
+import clr.bytecode as bc
+
+# Instructions that only push a value, so are dead if the value is popped straight away
+PURE_PUSHES = {
+    bc.Opcode.PUSH_CONST,
+    bc.Opcode.PUSH_TRUE,
+    bc.Opcode.PUSH_FALSE,
+    bc.Opcode.PUSH_NIL,
+    bc.Opcode.PUSH_LOCAL,
+}
+
+# Name that instructions outside of any function are reported under
+TOP_LEVEL = "<top level>"
+
+
+@dc.dataclass
+class Op:
+    """
+    Class for an opcode along with its operands.
+    """
+
+    opcode: bc.Opcode
+    operands: List[bc.Instruction] = dc.field(default_factory=list)
+
+    def target(self) -> Optional[bc.Label]:
+        """
+        Returns the label this op jumps forwards to, or None if it isn't a forward jump.
+        """
+        if self.opcode in (bc.Opcode.JUMP, bc.Opcode.JUMP_IF_FALSE):
+            offset = self.operands[0]
+            if isinstance(offset, bc.Offset) and not offset.backwards:
+                return offset.label
+        return None
+
+
+Item = Union[bc.Label, Op]
+
+
+def optimise_code(
+    instructions: List[bc.Instruction]
+) -> Tuple[List[bc.Instruction], List[Tuple[str, int]]]:
+    """
+    Optimise a list of instructions, returning the new instructions along with the number of
+    instructions saved in each function that had any saved.
+    """
+    items = _decode(instructions)
+    before = _count_ops(items)
+    while True:
+        size = len(items)
+        _thread_jumps(items)
+        items = _fold(_drop_unused_labels(_remove_empty_jumps(items)))
+        if len(items) == size:
+            break
+    after = _count_ops(items)
+    saved = [(label, count - after.get(label, 0)) for label, count in before.items()]
+    return (
+        _encode(items),
+        [
+            (TOP_LEVEL if label is None else label.name, count)
+            for label, count in saved
+            if count
+        ],
+    )
+
+
+def _decode(instructions: List[bc.Instruction]) -> List[Item]:
+    items: List[Item] = []
+    operands = 0
+    for instruction in instructions:
+        if isinstance(instruction, bc.Label):
+            items.append(instruction)
+        elif operands:
+            op = items[-1]
+            assert isinstance(op, Op)
+            op.operands.append(instruction)
+            operands -= 1
+            if len(op.operands) == 1:
+                operands += bc.table_size(op.opcode, instruction)
+        elif isinstance(instruction, bc.Opcode):
+            items.append(Op(instruction))
+            operands = bc.OPERAND_COUNTS[instruction]
+    return items
+
+
+def _encode(items: List[Item]) -> List[bc.Instruction]:
+    instructions: List[bc.Instruction] = []
+    for item in items:
+        if isinstance(item, Op):
+            instructions.append(item.opcode)
+            instructions.extend(item.operands)
+        else:
+            instructions.append(item)
+    return instructions
+
+
+def _count_ops(items: List[Item]) -> Dict[Optional[bc.Label], int]:
+    # Count the ops in each function, keyed by the label at the end of the function
+    counts: Dict[Optional[bc.Label], int] = {None: 0}
+    functions: List[bc.Label] = []
+    for item in items:
+        if isinstance(item, Op):
+            counts[functions[-1] if functions else None] += 1
+            if item.opcode == bc.Opcode.FUNCTION:
+                end = item.operands[0]
+                assert isinstance(end, bc.Offset)
+                functions.append(end.label)
+                counts[end.label] = 0
+        elif functions and item is functions[-1]:
+            functions.pop()
+    return counts
+
+
+def _thread_jumps(items: List[Item]) -> None:
+    # Find the op following each label
+    following: Dict[bc.Label, Op] = {}
+    next_op: Optional[Op] = None
+    for item in reversed(items):
+        if isinstance(item, Op):
+            next_op = item
+        elif next_op is not None:
+            following[item] = next_op
+    # Jumps to an unconditional jump can go straight to its target instead
+    for item in items:
+        if isinstance(item, Op):
+            target = item.target()
+            if target is None:
+                continue
+            while target in following and following[target].opcode == bc.Opcode.JUMP:
+                next_target = following[target].target()
+                if next_target is None:
+                    break
+                target = next_target
+            item.operands[0] = bc.Offset(target)
+
+
+def _remove_empty_jumps(items: List[Item]) -> List[Item]:
+    # Jumps to the next op don't need to go anywhere
+    result: List[Item] = []
+    for i, item in enumerate(items):
+        if isinstance(item, Op):
+            target = item.target()
+            j = i + 1
+            while j < len(items) and isinstance(items[j], bc.Label):
+                if items[j] is target:
+                    break
+                j += 1
+            else:
+                target = None
+            if target is not None:
+                # A conditional jump still has to pop the condition
+                if item.opcode == bc.Opcode.JUMP_IF_FALSE:
+                    result.append(Op(bc.Opcode.POP))
+                continue
+        result.append(item)
+    return result
+
+
+def _drop_unused_labels(items: List[Item]) -> List[Item]:
+    used = {
+        operand.label
+        for item in items
+        if isinstance(item, Op)
+        for operand in item.operands
+        if isinstance(operand, bc.Offset)
+    }
+    return [item for item in items if isinstance(item, Op) or item in used]
+
+
+def _fold(items: List[Item]) -> List[Item]:
+    # Cancel out pairs of adjacent ops, which can't be separated by a jump since there are no
+    # labels between them
+    result: List[Item] = []
+    for item in items:
+        if isinstance(item, Op) and result and isinstance(result[-1], Op):
+            last = result[-1].opcode
+            if item.opcode == bc.Opcode.NOT and last == bc.Opcode.NOT:
+                result.pop()
+                continue
+            if item.opcode == bc.Opcode.POP and last in PURE_PUSHES:
+                result.pop()
+                continue
+        result.append(item)
+    return result
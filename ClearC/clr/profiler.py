@@ -0,0 +1,118 @@
+"""
+Module for measuring the time, memory and ast nodes visited by each stage of the compiler.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Optional, Type, TypeVar
+
+import contextlib as cx
+import dataclasses as dc
+import json
+import time
+import tracemalloc
+
+import clr.ast as ast
+
+V = TypeVar("V", bound=ast.AstVisitor)  # pylint: disable=invalid-name
+
+# The methods nodes dispatch to when they accept a visitor
+VISIT_METHODS = [name for name in vars(ast.AstVisitor) if not name.startswith("_")]
+
+
+@dc.dataclass
+class StageReport:
+    """
+    Class for the measurements taken of a single stage. Measurements that weren't taken are None.
+    """
+
+    name: str
+    seconds: Optional[float] = None
+    nodes: Optional[int] = None
+    peak_bytes: Optional[int] = None
+
+    def counted(self, visitor: Type[V]) -> Type[V]:
+        """
+        Given a visitor class returns a subclass which counts the nodes it visits in this report.
+        """
+
+        def wrap(method: Callable[[Any, Any], None]) -> Callable[[Any, Any], None]:
+            def counted(visitor: Any, node: Any) -> None:
+                self.nodes = (self.nodes or 0) + 1
+                method(visitor, node)
+
+            return counted
+
+        namespace = {name: wrap(getattr(visitor, name)) for name in VISIT_METHODS}
+        return type(f"Counted{visitor.__name__}", (visitor,), namespace)
+
+
+class Profiler:
+    """
+    Class for keeping track of measurements of the stages of a compile.
+    """
+
+    def __init__(self, times: bool, memory: bool) -> None:
+        self.times = times
+        self.memory = memory
+        self.reports: List[StageReport] = []
+
+    def enabled(self) -> bool:
+        """
+        Returns whether any measurements are being taken.
+        """
+        return self.times or self.memory
+
+    @cx.contextmanager
+    def stage(self, name: str) -> Iterator[StageReport]:
+        """
+        Context manager to measure a stage of the compiler, yielding its report so that visitors
+        can be counted.
+        """
+        report = StageReport(name)
+        self.reports.append(report)
+        if self.memory:
+            # Restart tracing so that the peak only covers this stage
+            tracemalloc.stop()
+            tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            yield report
+        finally:
+            if self.times:
+                report.seconds = time.perf_counter() - start
+            if self.memory:
+                _, report.peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+    def visitor(self, report: StageReport, visitor: Type[V]) -> V:
+        """
+        Creates a visitor for a stage, which counts the nodes it visits if measurements are being
+        taken.
+        """
+        if self.enabled():
+            return report.counted(visitor)()
+        return visitor()
+
+    def display(self) -> str:
+        """
+        Display the measurements as a table.
+        """
+        width = max([len("Stage")] + [len(report.name) for report in self.reports])
+
+        def cell(value: Optional[float], scale: float, form: str) -> str:
+            return f"{'-':>12}" if value is None else f"{value * scale:>12{form}}"
+
+        lines = [f"{'Stage':<{width}} | {'ms':>12} | {'nodes':>12} | {'peak KiB':>12}"]
+        for report in self.reports:
+            lines.append(
+                f"{report.name:<{width}} | {cell(report.seconds, 1000, '.3f')}"
+                f" | {cell(report.nodes, 1, 'd')}"
+                f" | {cell(report.peak_bytes, 1 / 1024, '.1f')}"
+            )
+        return "\n".join(lines)
+
+    def to_json(self) -> str:
+        """
+        Returns the measurements as a JSON string.
+        """
+        stages: List[Dict[str, Any]] = [dc.asdict(report) for report in self.reports]
+        return json.dumps({"stages": stages}, indent=2)
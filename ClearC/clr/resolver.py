@@ -135,6 +135,8 @@ class NameResolver(ast.ContextVisitor):
 
     def set_stmt(self, node: ast.AstSetStmt) -> None:
         super().set_stmt(node)
+        if node.target.ref:
+            node.target.ref.mutated = True
         for context in reversed(self._contexts):
             if (
                 isinstance(context, ast.AstFuncDecl)
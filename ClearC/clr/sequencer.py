@@ -2,7 +2,7 @@
 Module for sequencing visitors / functions.
 """
 
-from typing import List, Union, Iterator
+from typing import List, Set, Union, Iterator
 
 import contextlib as cx
 
@@ -19,8 +19,11 @@ class SequenceBuilder(ast.DeepVisitor):
 
     def __init__(self) -> None:
         super().__init__()
-        self.started: List[Union[ast.AstNameDecl, ast.AstStructDecl]] = []
-        self.completed: List[Union[ast.AstNameDecl, ast.AstStructDecl]] = []
+        self.started: Set[Union[ast.AstNameDecl, ast.AstStructDecl]] = set()
+        self.completed: Set[Union[ast.AstNameDecl, ast.AstStructDecl]] = set()
+        # Functions whose bodies are being visited, in a new group each time a reference is
+        # followed, so that the last group holds the functions the current node is inside
+        self._bodies: List[List[ast.AstFuncDecl]] = [[]]
 
     def _decl(self, node: ast.AstDecl) -> None:
         if isinstance(node.context, (ast.AstBlockStmt, ast.Ast)):
@@ -32,13 +35,19 @@ class SequenceBuilder(ast.DeepVisitor):
             if isinstance(node, ast.AstFuncDecl):
                 node.context.sequence.append(node)
 
+    @cx.contextmanager
+    def _follow(self, inherit: bool = False) -> Iterator[None]:
+        self._bodies.append(list(self._bodies[-1]) if inherit else [])
+        yield
+        self._bodies.pop()
+
     @cx.contextmanager
     def _name_decl(
         self, node: Union[ast.AstNameDecl, ast.AstStructDecl]
     ) -> Iterator[None]:
-        self.started.append(node)
+        self.started.add(node)
         yield
-        self.completed.append(node)
+        self.completed.add(node)
 
     def struct_decl(self, node: ast.AstStructDecl) -> None:
         if node in self.completed:
@@ -74,15 +83,29 @@ class SequenceBuilder(ast.DeepVisitor):
             )
             return
         with self._name_decl(node):
+            self._bodies[-1].append(node)
             super().func_decl(node)
+            self._bodies[-1].pop()
 
     def ident_expr(self, node: ast.AstIdentExpr) -> None:
         if node.ref and node.ref.dependency:
-            node.ref.dependency.accept(self)
+            dependency = node.ref.dependency
+            # The body of a function can refer to it, since it isn't run until after the
+            # declaration
+            if dependency in self._bodies[-1]:
+                return
+            # Declaring a top level function doesn't run anything, so its body can refer back to
+            # the functions whose bodies led to it, allowing mutual recursion
+            inherit = isinstance(dependency, ast.AstFuncDecl) and isinstance(
+                dependency.context, ast.Ast
+            )
+            with self._follow(inherit):
+                dependency.accept(self)
 
     def construct_expr(self, node: ast.AstConstructExpr) -> None:
         if node.ref:
-            node.ref.accept(self)
+            with self._follow():
+                node.ref.accept(self)
 
     def _access_generator(self, generator: ast.AstFuncDecl) -> None:
         if generator in self.completed:
@@ -93,14 +116,12 @@ class SequenceBuilder(ast.DeepVisitor):
                 regions=[generator.block.decls[0].region],
             )
             return
-        generator.accept(self)
+        with self._follow():
+            generator.accept(self)
 
     def _access_this(self, node: ast.AstIdentExpr, field: str) -> None:
-        if node.struct:
-            for generator, bindings in node.struct.generators:
-                for binding in bindings:
-                    if binding.name == field:
-                        self._access_generator(generator)
+        if node.struct and field in node.struct.field_generators:
+            self._access_generator(node.struct.field_generators[field])
 
     def access_expr(self, node: ast.AstAccessExpr) -> None:
         if isinstance(node.target, ast.AstIdentExpr) and node.target.name == "this":
@@ -112,23 +133,24 @@ class SequenceWriter(ast.DeepVisitor):
     Ast visitor to put declarations in execution order from annotations.
     """
 
+    # Declarations are put in order before visiting them, so that passes sharing a walk with this
+    # one see them in order too.
+
     def start(self, node: ast.Ast) -> None:
-        super().start(node)
         node.decls = node.sequence
+        super().start(node)
 
     def struct_decl(self, node: ast.AstStructDecl) -> None:
-        super().struct_decl(node)
-
-        def get_bindings(target: ast.AstFuncDecl) -> List[ast.AstBinding]:
-            for generator, bindings in node.generators:
-                if generator == target:
-                    return bindings
-            return []
-
+        bindings = {generator: bindings for generator, bindings in node.generators}
         node.generators = [
-            (generator, get_bindings(generator)) for generator in node.sequence
+            (generator, bindings.get(generator, [])) for generator in node.sequence
         ]
+        # Field slots only depend on the order of the generators, so they're fixed from here on
+        node.slots = {}
+        for slot, binding in enumerate(node.iter_bindings()):
+            node.slots.setdefault(binding.name, slot)
+        super().struct_decl(node)
 
     def block_stmt(self, node: ast.AstBlockStmt) -> None:
-        super().block_stmt(node)
         node.decls = node.sequence
+        super().block_stmt(node)
@@ -2,14 +2,14 @@
 Module defining an ast visitor to type check.
 """
 
-from typing import List, Dict, Union
+from typing import List, Dict, Set, Union
 
 import clr.errors as er
 import clr.ast as ast
 import clr.types as ts
 
 
-class TypeChecker(ast.DeepVisitor):
+class TypeChecker(ast.ContextVisitor):
     """
     Ast visitor to annotate and check types.
     """
@@ -17,17 +17,22 @@ class TypeChecker(ast.DeepVisitor):
     def __init__(self) -> None:
         super().__init__()
         self.expected_returns: List[ts.Type] = []
+        self._signatures: Set[ast.AstFuncDecl] = set()
 
     def struct_decl(self, node: ast.AstStructDecl) -> None:
         node.type_annot = ts.StructType.make(node)
+        self._push_context(node)
         for param in node.params:
             param.accept(self)
         for generator, _ in node.generators:
+            self._push_context(generator)
             for param in generator.params:
                 param.accept(self)
             self.expected_returns.append(ts.ANY)
             generator.block.accept(self)
             self.expected_returns.pop()
+            self._pop_context()
+        self._pop_context()
 
     def _apply_decorators(
         self, decorators: List[ast.AstExpr], orig: ts.Type
@@ -104,9 +109,12 @@ class TypeChecker(ast.DeepVisitor):
                 for subtype, binding in zip(as_tuple.elements, node.bindings):
                     binding.type_annot = subtype
 
-    def func_decl(self, node: ast.AstFuncDecl) -> None:
-        for decorator in node.decorators:
-            decorator.accept(self)
+    def _signature(self, node: ast.AstFuncDecl) -> None:
+        # Mutually recursive functions can be referred to before they're checked, so their
+        # signatures are checked at whichever of those comes first
+        if node in self._signatures:
+            return
+        self._signatures.add(node)
         for param in node.params:
             param.accept(self)
         node.return_type.accept(self)
@@ -122,9 +130,16 @@ class TypeChecker(ast.DeepVisitor):
             [param.binding.type_annot for param in node.params],
             node.return_type.type_annot,
         )
+
+    def func_decl(self, node: ast.AstFuncDecl) -> None:
+        for decorator in node.decorators:
+            decorator.accept(self)
+        self._push_context(node)
+        self._signature(node)
         self.expected_returns.append(node.return_type.type_annot)
         node.block.accept(self)
         self.expected_returns.pop()
+        self._pop_context()
         node.binding.type_annot = self._apply_decorators(
             node.decorators, node.binding.type_annot
         )
@@ -262,6 +277,9 @@ class TypeChecker(ast.DeepVisitor):
 
     def ident_expr(self, node: ast.AstIdentExpr) -> None:
         if node.ref:
+            decl = node.ref.dependency
+            if isinstance(decl, ast.AstFuncDecl) and not decl.decorators:
+                self._signature(decl)
             node.type_annot = node.ref.type_annot
         else:
             node.type_annot = ts.BUILTINS[node.name].type_annot
@@ -274,6 +292,7 @@ class TypeChecker(ast.DeepVisitor):
 
     def case_expr(self, node: ast.AstCaseExpr) -> None:
         node.target.accept(self)
+        self._push_context(node)
         cases: Dict[ts.Type, ast.AstType] = {}
         output_type = ts.Type(set())
         for case_type, case_value in node.cases:
@@ -312,6 +331,7 @@ class TypeChecker(ast.DeepVisitor):
                 message=f"incomplete case expression, missing case(s) for {remaining}",
                 regions=[node.region],
             )
+        self._pop_context()
         node.type_annot = output_type
 
     def call_expr(self, node: ast.AstCallExpr) -> None:
@@ -390,10 +410,9 @@ class TypeChecker(ast.DeepVisitor):
             )
         else:
             node.ref = struct_type.ref
-            for binding in struct_type.ref.iter_bindings():
-                if node.name == binding.name:
-                    node.type_annot = binding.type_annot
-                    break
+            binding = struct_type.ref.fields.get(node.name)
+            if binding is not None:
+                node.type_annot = binding.type_annot
             else:
                 self.errors.add(
                     message=f"reference to undeclared field {node.name} for struct {struct_type}",
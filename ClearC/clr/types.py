@@ -2,9 +2,12 @@
 Module defining the type system.
 """
 
-from typing import NamedTuple, Set, List, Iterable, Optional, Any, Dict
+from typing import NamedTuple, List, Iterable, Optional, Any, Dict, FrozenSet, Tuple
 
 import enum
+import functools
+import itertools
+import weakref
 import dataclasses as dc
 
 # Module import for type annotations
@@ -99,13 +102,31 @@ class BuiltinType(UnitType, enum.Enum):
         return self != BuiltinType.VOID
 
 
-@dc.dataclass
+# Bits representing each builtin type in the bitmask of a type
+BUILTIN_BITS: Dict[BuiltinType, int] = {
+    unit: 1 << i for i, unit in enumerate(BuiltinType)
+}
+
+
 class StructType(UnitType):
     """
-    Represents a struct type.
+    Represents a struct type. The declaration is only referred to weakly, so that interned types
+    don't keep the ast alive.
     """
 
-    ref: "ast.AstStructDecl"
+    def __init__(self, ref: "ast.AstStructDecl") -> None:
+        self._ref = weakref.ref(ref)
+        # Hashed up front so that the intern table can still drop it after the ast is gone
+        self._hash = hash(str(ref))
+
+    @property
+    def ref(self) -> "ast.AstStructDecl":
+        """
+        The declaration of the struct.
+        """
+        ref = self._ref()
+        assert ref is not None, "struct type used after its declaration was freed"
+        return ref
 
     @staticmethod
     def make(ref: "ast.AstStructDecl") -> "Type":
@@ -117,12 +138,15 @@ class StructType(UnitType):
     def __str__(self) -> str:
         return self.ref.name
 
+    def __repr__(self) -> str:
+        return f"StructType(ref={self._ref()!r})"
+
     def __hash__(self) -> int:
-        return hash(str(self.ref))
+        return self._hash
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, StructType):
-            return self.ref == other.ref
+            return self._ref == other._ref
         if isinstance(other, (UnresolvedType, BuiltinType, FunctionType, TupleType)):
             return False
         return NotImplemented
@@ -226,30 +250,75 @@ class TupleType(UnitType):
 
 class Type:
     """
-    Class representing the type of a value, with a set of subtypes.
+    Class representing the type of a value, with a set of subtypes. Builtin subtypes are stored
+    as a bitmask, separately from the set of other subtypes. Types are interned, so that
+    structurally equal types are the same object.
     """
 
-    def __init__(self, units: Set[UnitType], is_any: bool = False) -> None:
-        self.units = units
-        self.contract()
-        self.is_any = is_any
+    units: FrozenSet[UnitType]
+    builtins: int
+    structural: FrozenSet[UnitType]
+    is_any: bool
+    # Index of the type in the intern table, used to key caches of type operations
+    serial: int
+    _hash: int
+
+    def __new__(cls, units: Iterable[UnitType], is_any: bool = False) -> "Type":
+        builtins = 0
+        structural = set()
+        for unit in units:
+            if isinstance(unit, BuiltinType):
+                builtins |= BUILTIN_BITS[unit]
+            else:
+                structural.add(unit)
+        return Type.make(builtins, frozenset(structural), is_any)
+
+    @staticmethod
+    def make(
+        builtins: int, structural: FrozenSet[UnitType], is_any: bool = False
+    ) -> "Type":
+        """
+        Get the type with the given bitmask of builtin types and set of other units.
+        """
+        key = (builtins, structural, is_any)
+        interned = _INTERNED.get(key)
+        if interned is None:
+            contracted = (builtins, _contract(structural), is_any)
+            interned = _INTERNED.get(contracted)
+            if interned is None:
+                interned = object.__new__(Type)
+                interned.builtins, interned.structural, interned.is_any = contracted
+                interned.units = interned.structural.union(
+                    unit for unit, bit in BUILTIN_BITS.items() if builtins & bit
+                )
+                interned.serial = next(_SERIALS)
+                interned._hash = hash(contracted)
+                _TYPES[interned.serial] = interned
+                _INTERNED[contracted] = interned
+            _INTERNED[key] = interned
+        return interned
 
     def __str__(self) -> str:
         if self.is_any:
             return "anything"
-        if BuiltinType.NIL in self.units:
-            target = " | ".join(
-                str(unit) for unit in self.units if unit != BuiltinType.NIL
-            )
+        # Builtin types are displayed first, in a consistent order
+        units: List[UnitType] = [
+            unit for unit, bit in BUILTIN_BITS.items() if self.builtins & bit
+        ]
+        units.extend(self.structural)
+        if self.builtins & BUILTIN_BITS[BuiltinType.NIL]:
+            target = " | ".join(str(unit) for unit in units if unit != BuiltinType.NIL)
             return f"({target})?"
-        return " | ".join(f"({unit})" for unit in self.units)
+        return " | ".join(f"({unit})" for unit in units)
 
     def __hash__(self) -> int:
-        return hash(tuple(self.units))
+        return self._hash
 
     def __eq__(self, other: object) -> bool:
         if isinstance(other, Type):
-            return self.is_any or self.units == other.units
+            # Anything is equal to every type, and the only other types with the same units as
+            # anything are empty
+            return self is other or self.is_any or (other.is_any and not self.units)
         if isinstance(
             other, (UnresolvedType, BuiltinType, StructType, FunctionType, TupleType)
         ):
@@ -290,60 +359,107 @@ class Type:
         """
         return self._get_as(FunctionType)
 
-    def contract(self) -> None:
-        """
-        Simplify the union type.
-        """
-        if len(self.units) <= 1:
-            return
-        rest = self.units
-        # Take out functions and tuples
-        functions, rest = util.split_instances(FunctionType, rest)
-        tuples, rest = util.split_instances(TupleType, rest)
-        # Contract functions
-        function_groups = util.group_by(
-            lambda function: len(function.parameters), functions
-        )
-        for param_count, function_group in function_groups.items():
-            union_return = union(function.return_type for function in function_group)
-            union_params = [
-                intersection(function.parameters[i] for function in function_group)
-                for i in range(param_count)
-            ]
-            rest.add(FunctionType(union_params, union_return))
-        # Contract tuples
-        tuple_groups = util.group_by(
-            lambda tuple_type: len(tuple_type.elements), tuples
-        )
-        for element_count, tuple_group in tuple_groups.items():
-            union_elements = [
-                union(tuple_type.elements[i] for tuple_type in tuple_group)
-                for i in range(element_count)
-            ]
-            rest.add(TupleType(union_elements))
-        # Apply the contractions
-        self.units = rest
+
+def _contract(units: FrozenSet[UnitType]) -> FrozenSet[UnitType]:
+    """
+    Simplify the units of a union type.
+    """
+    if len(units) <= 1:
+        return units
+    # Take out functions and tuples
+    functions, rest = util.split_instances(FunctionType, units)
+    tuples, rest = util.split_instances(TupleType, rest)
+    # Contract functions
+    function_groups = util.group_by(
+        lambda function: len(function.parameters), functions
+    )
+    for param_count, function_group in function_groups.items():
+        union_return = union(function.return_type for function in function_group)
+        union_params = [
+            intersection(function.parameters[i] for function in function_group)
+            for i in range(param_count)
+        ]
+        rest.add(FunctionType(union_params, union_return))
+    # Contract tuples
+    tuple_groups = util.group_by(lambda tuple_type: len(tuple_type.elements), tuples)
+    for element_count, tuple_group in tuple_groups.items():
+        union_elements = [
+            union(tuple_type.elements[i] for tuple_type in tuple_group)
+            for i in range(element_count)
+        ]
+        rest.add(TupleType(union_elements))
+    return frozenset(rest)
+
+
+# Intern table of types by their units (before and after contraction), and a table of them by
+# serial. Types are only kept while something else refers to them, so that the struct declarations
+# they refer to aren't kept alive after compiling. Serials aren't reused, so cached results for a
+# type that's gone are never looked up again.
+_INTERNED: "weakref.WeakValueDictionary[Tuple[int, FrozenSet[UnitType], bool], Type]" = (
+    weakref.WeakValueDictionary()
+)
+_TYPES: "weakref.WeakValueDictionary[int, Type]" = weakref.WeakValueDictionary()
+_SERIALS = itertools.count()
+
+_NO_UNITS: FrozenSet[UnitType] = frozenset()
+
+# Maximum number of results to remember for each type operation
+CACHE_SIZE = 4096
+
+
+def _only_builtins(types: Iterable[Type]) -> bool:
+    return all(not subtype.structural and not subtype.is_any for subtype in types)
 
 
 def union(types: Iterable[Type]) -> Type:
     """
     Returns the union of an iterable of types.
     """
-    types = list(types)
+    types = tuple(types)
+    if _only_builtins(types):
+        builtins = 0
+        for subtype in types:
+            builtins |= subtype.builtins
+        return Type.make(builtins, _NO_UNITS)
+    return _union(tuple(subtype.serial for subtype in types))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _union(serials: Tuple[int, ...]) -> Type:
+    types = [_TYPES[serial] for serial in serials]
     if any(subtype.is_any for subtype in types):
         return ANY
-    return Type(set.union(*(subtype.units for subtype in types if not subtype.is_any)))
+    builtins = 0
+    for subtype in types:
+        builtins |= subtype.builtins
+    return Type.make(
+        builtins, frozenset.union(*(subtype.structural for subtype in types))
+    )
 
 
 def intersection(types: Iterable[Type]) -> Type:
     """
     Returns the intersection of an iterable of types.
     """
-    types = list(types)
-    if all(subtype.is_any for subtype in types):
+    types = tuple(types)
+    if types and _only_builtins(types):
+        builtins = types[0].builtins
+        for subtype in types:
+            builtins &= subtype.builtins
+        return Type.make(builtins, _NO_UNITS)
+    return _intersection(tuple(subtype.serial for subtype in types))
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _intersection(serials: Tuple[int, ...]) -> Type:
+    types = [_TYPES[serial] for serial in serials if not _TYPES[serial].is_any]
+    if not types:
         return ANY
-    return Type(
-        set.intersection(*(subtype.units for subtype in types if not subtype.is_any))
+    builtins = types[0].builtins
+    for subtype in types:
+        builtins &= subtype.builtins
+    return Type.make(
+        builtins, frozenset.intersection(*(subtype.structural for subtype in types))
     )
 
 
@@ -351,29 +467,48 @@ def difference(lhs: Type, rhs: Type) -> Type:
     """
     Returns the difference between two types.
     """
-    if rhs == ANY:
-        return Type(set())
-    if not rhs.units:
-        return lhs
-    return Type(set.difference(lhs.units, rhs.units))
+    # Note that the empty type is equal to anything, so the difference with it is also empty
+    if rhs.is_any or not rhs.units:
+        return EMPTY
+    if _only_builtins((lhs, rhs)):
+        return Type.make(lhs.builtins & ~rhs.builtins, _NO_UNITS)
+    return _difference(lhs.serial, rhs.serial)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _difference(lhs_serial: int, rhs_serial: int) -> Type:
+    lhs, rhs = _TYPES[lhs_serial], _TYPES[rhs_serial]
+    return Type.make(
+        lhs.builtins & ~rhs.builtins, lhs.structural.difference(rhs.structural)
+    )
 
 
 def contains(inner: Type, outer: Type) -> bool:
     """
     Returns whether the inner type is a subtype of the outer type.
     """
-    return union((inner, outer)) == outer
+    if inner.is_any or outer.is_any:
+        return True
+    if not inner.structural and not outer.structural:
+        return not inner.builtins & ~outer.builtins
+    return _contains(inner.serial, outer.serial)
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _contains(inner_serial: int, outer_serial: int) -> bool:
+    outer = _TYPES[outer_serial]
+    return union((_TYPES[inner_serial], outer)) == outer
 
 
 def valid(check_type: Type) -> bool:
     """
     Checks whether a type is a valid type for a value.
     """
-    if not check_type.units:
+    if not check_type.units or check_type.builtins & BUILTIN_BITS[BuiltinType.VOID]:
         return False
     return all(
         not isinstance(unit, UnresolvedType) and unit.valid()
-        for unit in check_type.units
+        for unit in check_type.structural
     )
 
 
@@ -385,6 +520,7 @@ NUM = Type({BuiltinType.NUM})
 STR = Type({BuiltinType.STR})
 UNRESOLVED = Type({UnresolvedType()})
 ANY = Type(set(), is_any=True)
+EMPTY = Type(set())
 
 
 class Builtin(NamedTuple):
@@ -4,7 +4,7 @@ Given a module name, it loads the .clr file, compiles it,
 and exports the assembled .clr.b.
 """
 
-from typing import Iterable, Sequence, Tuple
+from typing import Dict, Iterable, Sequence, Tuple
 
 import sys
 
@@ -13,23 +13,47 @@ import clr.bytecode as bc
 import clr.lexer as lx
 import clr.parser as ps
 import clr.printer as pr
-import clr.resolver as rs
-import clr.sequencer as sq
-import clr.typechecker as tc
-import clr.flowchecker as fc
-import clr.indexer as ix
+import clr.passes as pm
 import clr.codegenerator as cg
+import clr.peephole as ph
+import clr.profiler as pf
 
 DEBUG = True
 
-# TODO: tests
+
+OPTIONS = {
+    "--time-passes": "report the time taken by each stage",
+    "--mem-passes": "report the peak memory allocated by each stage",
+    "--passes-json=<file>": "also write the report to a JSON file",
+}
+
+
+def _get_options() -> Dict[str, str]:
+    options = {}
+    # Map each option name to its usage, which mentions a value if it takes one
+    names = {option.partition("=")[0]: option for option in OPTIONS}
+    for arg in sys.argv[2:]:
+        name, _, value = arg.partition("=")
+        if name not in names:
+            print(f"Unknown option {arg}")
+            sys.exit(1)
+        if "=" in names[name] and not value:
+            print(f"Option {name} needs a value")
+            print("Usage:")
+            print(f"$ clr <module name> {names[name]}")
+            sys.exit(1)
+        options[name] = value
+    return options
 
 
 def _get_filenames() -> Tuple[str, str]:
-    if len(sys.argv) < 2:
+    if len(sys.argv) < 2 or sys.argv[1].startswith("--"):
         print("Please provide a module to compile")
         print("Usage:")
-        print("$ clr <module name>")
+        print("$ clr <module name> [options]")
+        print("Options:")
+        for option, description in OPTIONS.items():
+            print(f"    {option:<22} {description}")
         sys.exit(1)
 
     source_file_name = sys.argv[1] + ".clr"
@@ -84,20 +108,32 @@ def main() -> None:
     The main entry point function.
     """
     source_file_name, dest_file_name = _get_filenames()
-    source = _read_source(source_file_name)
-
-    if not source:
+    options = _get_options()
+    profiler = pf.Profiler(
+        times="--time-passes" in options or "--passes-json" in options,
+        memory="--mem-passes" in options,
+    )
+    source = er.SourceFile(text=_read_source(source_file_name), path=source_file_name)
+
+    if not source.text:
         print("No source code found in {source_file_name}")
         sys.exit(1)
 
     print("--------")
 
-    # Lexical analysis
-    tokens, lex_errors = lx.tokenize_source(source)
-    _check_errors("Lexical", lex_errors)
+    # Lexical and syntax analysis, streaming tokens from the lexer straight into the parser
+    lex_errors = er.ErrorTracker()
+    tokens = lx.stream_source(source, lex_errors)
+    if profiler.enabled():
+        # Lex everything up front so that lexing and parsing are measured separately
+        with profiler.stage("Lexer"):
+            tokens.finish()
+    with profiler.stage("Parser"):
+        tree = ps.parse_tokens(tokens)
+    # Finish lexing in case the parser stopped early, so that all lexical errors are found
+    tokens.finish()
+    _check_errors("Lexical", lex_errors.get())
 
-    # Syntax analysis
-    tree = ps.parse_tokens(tokens)
     if isinstance(tree, er.CompileError):
         _check_errors("Syntax", [tree])
         sys.exit(1)  # Even if it's only a warning we can't do much without the tree.
@@ -108,35 +144,49 @@ def main() -> None:
         tree.accept(pr.AstPrinter())
         print("--------")
 
-    # Semantic analysis
-    subpasses = [
-        ("Resolve", rs.DuplicateChecker()),
-        ("Resolve", rs.NameTracker()),
-        ("Resolve", rs.NameResolver()),
-        ("Sequencing", sq.SequenceBuilder()),
-        ("Sequencing", sq.SequenceWriter()),
-        ("Type", tc.TypeChecker()),
-        ("Control Flow", fc.FlowChecker()),
-        ("Indexing", ix.UpvalueTracker()),
-        ("Indexing", ix.IndexBuilder()),
-        ("Indexing", ix.IndexWriter()),
-    ]
-
-    for name, visitor in subpasses:
-        tree.accept(visitor)
-        _check_errors(name, visitor.errors.get())
-        if DEBUG and isinstance(visitor, sq.SequenceWriter):
-            print("Sequenced Ast:")
-            print("--------")
-            tree.accept(pr.AstPrinter())
-            print("--------")
+    # Semantic analysis, with passes sharing walks of the tree where possible unless each pass is
+    # being measured
+    pipeline = pm.SEPARATE_PIPELINE if profiler.enabled() else pm.SEMANTIC_PIPELINE
+    for group in pipeline:
+        passes = ", ".join(member.visitor.__name__ for member in group.passes)
+        with profiler.stage(passes) as report:
+            visitor = profiler.visitor(report, group.visitor)
+            tree.accept(visitor)
+        _check_errors(group.name(), visitor.errors.get())
+
+    if DEBUG:
+        # The tree is sequenced, folded and has had dead code removed by now
+        print("Analysed Ast:")
+        print("--------")
+        tree.accept(pr.AstPrinter())
+        print("--------")
 
     # Code generation
-    assembled = _assemble_code(*cg.generate_code(tree))
+    with profiler.stage("CodeGenerator") as report:
+        constants, instructions = cg.generate_code(
+            tree, profiler.visitor(report, cg.CodeGenerator)
+        )
+    with profiler.stage("Peephole"):
+        instructions, saved = ph.optimise_code(instructions)
+    if DEBUG and saved:
+        print("Peephole Savings:")
+        print("--------")
+        for name, count in saved:
+            print(f"{name}: {count} instructions")
+        print(f"total: {sum(count for _, count in saved)} instructions")
+        print("--------")
+    with profiler.stage("Assembly"):
+        assembled = _assemble_code(constants, instructions)
 
     with open(dest_file_name, "wb") as dest_file:
         dest_file.write(assembled)
 
+    if profiler.enabled():
+        print(profiler.display())
+        if "--passes-json" in options:
+            with open(options["--passes-json"], "w") as report_file:
+                report_file.write(profiler.to_json())
+
 
 if __name__ == "__main__":
 
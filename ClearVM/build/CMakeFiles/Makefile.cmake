@@ -0,0 +1,104 @@
+# CMAKE generated file: DO NOT EDIT!
+# Generated by "Unix Makefiles" Generator, CMake Version 3.25
+
+# The generator used is:
+set(CMAKE_DEPENDS_GENERATOR "Unix Makefiles")
+
+# The top level Makefile was generated from the following files:
+set(CMAKE_MAKEFILE_DEPENDS
+  "CMakeCache.txt"
+  "/root/package/ClearVM/CMakeLists.txt"
+  "CMakeFiles/3.25.1/CMakeCCompiler.cmake"
+  "CMakeFiles/3.25.1/CMakeSystem.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeCCompiler.cmake.in"
+  "/usr/share/cmake-3.25/Modules/CMakeCCompilerABI.c"
+  "/usr/share/cmake-3.25/Modules/CMakeCInformation.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeCommonLanguageInclude.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeCompilerIdDetection.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineCCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineCompileFeatures.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineCompilerABI.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineCompilerId.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeDetermineSystem.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeFindBinUtils.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeGenericSystem.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeInitializeConfigs.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeLanguageInformation.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeParseImplicitIncludeInfo.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeParseImplicitLinkInfo.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeParseLibraryArchitecture.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeSystem.cmake.in"
+  "/usr/share/cmake-3.25/Modules/CMakeSystemSpecificInformation.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeSystemSpecificInitialize.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeTestCCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeTestCompilerCommon.cmake"
+  "/usr/share/cmake-3.25/Modules/CMakeUnixFindMake.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/ADSP-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/ARMCC-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/ARMClang-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/AppleClang-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Borland-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Bruce-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/CMakeCommonCompilerMacros.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Clang-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Clang-DetermineCompilerInternal.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Compaq-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Cray-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Embarcadero-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Fujitsu-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/FujitsuClang-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/GHS-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/GNU-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/GNU-C.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/GNU-FindBinUtils.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/GNU.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/HP-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/IAR-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/IBMCPP-C-DetermineVersionInternal.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/IBMClang-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Intel-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/IntelLLVM-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/LCC-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/MSVC-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/NVHPC-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/NVIDIA-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/OpenWatcom-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/PGI-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/PathScale-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/SCO-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/SDCC-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/SunPro-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/TI-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Tasking-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/TinyCC-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/VisualAge-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/Watcom-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/XL-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/XLClang-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Compiler/zOS-C-DetermineCompiler.cmake"
+  "/usr/share/cmake-3.25/Modules/Internal/FeatureTesting.cmake"
+  "/usr/share/cmake-3.25/Modules/Platform/Linux-GNU-C.cmake"
+  "/usr/share/cmake-3.25/Modules/Platform/Linux-GNU.cmake"
+  "/usr/share/cmake-3.25/Modules/Platform/Linux.cmake"
+  "/usr/share/cmake-3.25/Modules/Platform/UnixPaths.cmake"
+  )
+
+# The corresponding makefile is:
+set(CMAKE_MAKEFILE_OUTPUTS
+  "Makefile"
+  "CMakeFiles/cmake.check_cache"
+  )
+
+# Byproducts of CMake generate step:
+set(CMAKE_MAKEFILE_PRODUCTS
+  "CMakeFiles/3.25.1/CMakeSystem.cmake"
+  "CMakeFiles/3.25.1/CMakeCCompiler.cmake"
+  "CMakeFiles/3.25.1/CMakeCCompiler.cmake"
+  "CMakeFiles/CMakeDirectoryInformation.cmake"
+  )
+
+# Dependency information for all targets:
+set(CMAKE_DEPEND_INFO_FILES
+  "CMakeFiles/clr.dir/DependInfo.cmake"
+  )
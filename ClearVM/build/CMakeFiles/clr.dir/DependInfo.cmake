@@ -0,0 +1,23 @@
+
+# Consider dependencies only in project.
+set(CMAKE_DEPENDS_IN_PROJECT_ONLY OFF)
+
+# The set of languages for which implicit dependencies are needed:
+set(CMAKE_DEPENDS_LANGUAGES
+  )
+
+# The set of dependency files which are needed:
+set(CMAKE_DEPENDS_DEPENDENCY_FILES
+  "/root/package/ClearVM/bytecode.c" "CMakeFiles/clr.dir/bytecode.c.o" "gcc" "CMakeFiles/clr.dir/bytecode.c.o.d"
+  "/root/package/ClearVM/main.c" "CMakeFiles/clr.dir/main.c.o" "gcc" "CMakeFiles/clr.dir/main.c.o.d"
+  "/root/package/ClearVM/memory.c" "CMakeFiles/clr.dir/memory.c.o" "gcc" "CMakeFiles/clr.dir/memory.c.o.d"
+  "/root/package/ClearVM/value.c" "CMakeFiles/clr.dir/value.c.o" "gcc" "CMakeFiles/clr.dir/value.c.o.d"
+  "/root/package/ClearVM/vm.c" "CMakeFiles/clr.dir/vm.c.o" "gcc" "CMakeFiles/clr.dir/vm.c.o.d"
+  )
+
+# Targets to which this target links.
+set(CMAKE_TARGET_LINKED_INFO_FILES
+  )
+
+# Fortran module output directory.
+set(CMAKE_Fortran_TARGET_MODULE_DIR "")
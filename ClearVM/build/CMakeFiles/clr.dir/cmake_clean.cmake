@@ -0,0 +1,19 @@
+file(REMOVE_RECURSE
+  "CMakeFiles/clr.dir/bytecode.c.o"
+  "CMakeFiles/clr.dir/bytecode.c.o.d"
+  "CMakeFiles/clr.dir/main.c.o"
+  "CMakeFiles/clr.dir/main.c.o.d"
+  "CMakeFiles/clr.dir/memory.c.o"
+  "CMakeFiles/clr.dir/memory.c.o.d"
+  "CMakeFiles/clr.dir/value.c.o"
+  "CMakeFiles/clr.dir/value.c.o.d"
+  "CMakeFiles/clr.dir/vm.c.o"
+  "CMakeFiles/clr.dir/vm.c.o.d"
+  "clr"
+  "clr.pdb"
+)
+
+# Per-language clean rules from dependency scanning.
+foreach(lang C)
+  include(CMakeFiles/clr.dir/cmake_clean_${lang}.cmake OPTIONAL)
+endforeach()
@@ -57,15 +57,54 @@ static Result disassembleSimple(const char *name, size_t *index) {
     }
 
 DIS_UNARY(U8, "%d", uint8_t)
+DIS_UNARY(U16, "%d", uint16_t)
 DIS_UNARY(S32, "'%d'", int32_t)
 DIS_UNARY(F64, "'%f'", double)
 DIS_BINARY(U8U8, "%d", uint8_t, "%d", uint8_t)
+DIS_BINARY(U16U16, "%d", uint16_t, "%d", uint16_t)
 
 #undef DIS_BINARY
 #undef DIS_UNARY
 
+static Result disassembleTable(const char *name, uint8_t *code, size_t length,
+                               size_t *index, bool wide) {
+
+    size_t width = wide ? sizeof(uint16_t) : sizeof(uint8_t);
+
+    *index = *index + 1;
+    if (*index > length - width) {
+
+        printf("\n|| EOF reached while parsing jump table size\n");
+        return RESULT_ERR;
+    }
+
+    size_t count = wide ? *(uint16_t *)(code + *index) : code[*index];
+    *index += width;
+
+    // The entries are followed by the default offset
+    if ((count + 1) * width > length - *index) {
+
+        printf("\n|| EOF reached while parsing jump table\n");
+        return RESULT_ERR;
+    }
+
+    printf("%-18s %zu", name, count);
+
+    for (size_t i = 0; i <= count; i++) {
+
+        size_t offset = wide ? *(uint16_t *)(code + *index) : code[*index];
+        *index += width;
+
+        printf(" %zu", offset);
+    }
+
+    printf("\n");
+
+    return RESULT_OK;
+}
+
 static Result disassembleInstruction(uint8_t *code, size_t length,
-                                     size_t *index) {
+                                     size_t *index, bool wide) {
 
     printf("%04zu ", *index);
 
@@ -77,10 +116,20 @@ static Result disassembleInstruction(uint8_t *code, size_t length,
     } break;
 #define U8(name)                                                               \
     case name: {                                                               \
+        if (wide) {                                                            \
+            return disassembleU16(#name, code, length, index);                 \
+        }                                                                      \
         return disassembleU8(#name, code, length, index);                      \
     } break;
+#define TABLE(name)                                                            \
+    case name: {                                                               \
+        return disassembleTable(#name, code, length, index, wide);             \
+    } break;
 #define U8U8(name)                                                             \
     case name: {                                                               \
+        if (wide) {                                                            \
+            return disassembleU16U16(#name, code, length, index);              \
+        }                                                                      \
         return disassembleU8U8(#name, code, length, index);                    \
     } break;
 
@@ -148,6 +197,27 @@ static Result disassembleInstruction(uint8_t *code, size_t length,
         U8(OP_IS_VAL_TYPE)
         U8(OP_IS_OBJ_TYPE)
 
+        U8(OP_TAIL_CALL)
+        U8U8(OP_CALL_DIRECT)
+
+        TABLE(OP_SWITCH_VALTYPE)
+        TABLE(OP_SWITCH_TAG)
+
+        case OP_WIDE: {
+
+            disassembleSimple("OP_WIDE", index);
+
+            if (wide || *index >= length) {
+
+                printf("|| Expected an opcode to widen\n");
+                return RESULT_ERR;
+            }
+
+            return disassembleInstruction(code, length, index, true);
+
+        } break;
+
+#undef TABLE
 #undef U8U8
 #undef U8
 #undef SIMPLE
@@ -165,8 +235,14 @@ Result disassembleCode(uint8_t *code, size_t length) {
 
     size_t index = 0;
 
-    size_t constantCount = *(uint8_t *)code;
-    index = index + sizeof(uint8_t);
+    if (length < sizeof(uint16_t)) {
+
+        printf("|| EOF reached while parsing constant count\n");
+        return RESULT_ERR;
+    }
+
+    size_t constantCount = *(uint16_t *)code;
+    index = index + sizeof(uint16_t);
 
     for (size_t i = 0; i < constantCount; i++) {
 
@@ -199,23 +275,23 @@ Result disassembleCode(uint8_t *code, size_t length) {
                 printf("%-18s ", "CONST_STR");
                 index++;
 
-                if (index > length - sizeof(uint8_t)) {
+                if (index > length - sizeof(uint32_t)) {
 
                     printf(
                         "\n|| EOF reached instead of constant string length\n");
                     return RESULT_ERR;
                 }
 
-                uint8_t strLength = *(uint8_t *)(code + index);
-                index += sizeof(uint8_t);
+                uint32_t strLength = *(uint32_t *)(code + index);
+                index += sizeof(uint32_t);
 
-                if (index > length - strLength) {
+                if (strLength > length - index) {
 
                     printf("\n|| Reached EOF while parsing constant string\n");
                     return RESULT_ERR;
                 }
 
-                printf("'%.*s'\n", strLength, code + index);
+                printf("'%.*s'\n", (int)strLength, code + index);
                 index += strLength;
 
             } break;
@@ -231,7 +307,7 @@ Result disassembleCode(uint8_t *code, size_t length) {
 
     while (index < length) {
 
-        if (disassembleInstruction(code, length, &index) != RESULT_OK) {
+        if (disassembleInstruction(code, length, &index, false) != RESULT_OK) {
 
             printf("|| Instruction at index %zu was invalid\n", index);
             return RESULT_ERR;
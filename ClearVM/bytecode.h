@@ -89,7 +89,18 @@ typedef enum {
     OP_IS_VAL_TYPE = 51,
     OP_IS_OBJ_TYPE = 52,
 
-    OP_COUNT = 53
+    // Operand width
+    OP_WIDE = 53,
+
+    // Calls
+    OP_TAIL_CALL = 54,
+    OP_CALL_DIRECT = 55,
+
+    // Switches
+    OP_SWITCH_VALTYPE = 56,
+    OP_SWITCH_TAG = 57,
+
+    OP_COUNT = 58
 
 } OpCode;
 
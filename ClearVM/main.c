@@ -87,7 +87,8 @@ int main(int argc, char **argv) {
         EXIT(1);
     }
 
-    VM vm;
+    // The vm is too large to keep on the stack
+    static VM vm;
     if (initVM(&vm) != RESULT_OK) {
 
         printf("|| Could not initialize vm\n");
@@ -136,10 +136,32 @@ Value makeFP(Value *unboxed) {
     return result;
 }
 
-void closeUpvalue(UpvalueObject *upvalue) {
+void closeUpvalues(Value *value) {
 
-    upvalue->closed = *upvalue->ptr;
-    upvalue->ptr = &upvalue->closed;
+    // Copies of the value made while it was on the stack share its list of
+    // references, so only upvalues that still point to it are closed
+    Value *closed = NULL;
+
+    for (UpvalueObject *upvalue = value->references; upvalue != NULL;
+         upvalue = upvalue->next) {
+
+        if (upvalue->ptr != value) {
+            continue;
+        }
+
+        // Every upvalue shares the first one's copy, so that changes through
+        // any of them are seen by the others
+        if (closed == NULL) {
+
+            upvalue->closed = *value;
+            upvalue->closed.references = NULL;
+            closed = &upvalue->closed;
+        }
+
+        upvalue->ptr = closed;
+    }
+
+    value->references = NULL;
 }
 
 Result stringifyValue(VM *vm, Value input, Value *output) {
@@ -3,7 +3,8 @@
 
 #include "common.h"
 
-#define STR_MAX 512
+// Matches the 32-bit length of str constants
+#define STR_MAX UINT32_MAX
 #define NUM_PLACES 7
 #define NUM_PRECISION 0.0000001
 
@@ -91,7 +92,7 @@ Value makeNil();
 Value makeIP(uint8_t *unboxed);
 Value makeFP(Value *unboxed);
 
-void closeUpvalue(UpvalueObject *upvalue);
+void closeUpvalues(Value *value);
 Result stringifyValue(VM *vm, Value input, Value *output);
 Value concatStrings(VM *vm, StringObject a, StringObject b);
 bool valuesEqual(Value a, Value b);
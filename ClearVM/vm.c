@@ -65,6 +65,44 @@ static Result readU8(VM *vm, uint8_t *out) {
     return RESULT_OK;
 }
 
+static Result readU16(VM *vm, uint16_t *out) {
+
+    if ((long)sizeof(uint16_t) > vm->end - vm->ip) {
+
+        printf("|| Ran out of bytes reading instruction\n");
+        return RESULT_ERR;
+    }
+
+    if (out != NULL) {
+
+        *out = *(uint16_t *)(vm->ip);
+    }
+
+    vm->ip += sizeof(uint16_t);
+    return RESULT_OK;
+}
+
+static Result readOperand(VM *vm, uint16_t *out) {
+
+    if (vm->wide) {
+
+        return readU16(vm, out);
+    }
+
+    uint8_t narrow;
+    if (readU8(vm, &narrow) != RESULT_OK) {
+
+        return RESULT_ERR;
+    }
+
+    if (out != NULL) {
+
+        *out = narrow;
+    }
+
+    return RESULT_OK;
+}
+
 #define POP(name)                                                              \
     if (vm->sp - vm->stack == 0) {                                             \
                                                                                \
@@ -111,9 +149,9 @@ static Result readU8(VM *vm, uint8_t *out) {
     Value *name = vm->sp - offset - 1;
 
 #define READ(name)                                                             \
-    uint8_t name;                                                              \
-    if (readU8(vm, &name) != RESULT_OK) {                                      \
-        printf("|| Could not read byte\n");                                    \
+    uint16_t name;                                                             \
+    if (readOperand(vm, &name) != RESULT_OK) {                                 \
+        printf("|| Could not read operand\n");                                 \
         return RESULT_ERR;                                                     \
     }
 
@@ -150,7 +188,7 @@ static void traceOpcode(VM *vm, const char *name, bool endLine) {
 #endif
 }
 
-static void traceU8(uint8_t value, bool endLine) {
+static void traceOperand(uint16_t value, bool endLine) {
 
 #ifdef DEBUG_TRACE
 
@@ -198,7 +236,7 @@ static Result op_pushConst(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_PUSH_CONST", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     if (index >= vm->constantCount) {
 
@@ -243,7 +281,7 @@ static Result op_setGlobal(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_SET_GLOBAL", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     POP(value)
 
@@ -261,7 +299,7 @@ static Result op_pushGlobal(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_PUSH_GLOBAL", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     Value global;
     if (getGlobal(&vm->globals, index, &global) != RESULT_OK) {
@@ -280,7 +318,7 @@ static Result op_setLocal(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_SET_LOCAL", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     POP(value)
 
@@ -301,7 +339,7 @@ static Result op_pushLocal(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_PUSH_LOCAL", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     if (index >= vm->sp - vm->fp) {
 
@@ -511,12 +549,10 @@ static Result op_pop(VM *vm) {
     traceOpcode(vm, "OP_POP", true);
 
     POP(value)
+    UNUSED(value);
 
-    while (value.references != NULL) {
-
-        closeUpvalue(value.references);
-        value.references = value.references->next;
-    }
+    // The popped value is still in its slot just above the stack
+    closeUpvalues(vm->sp);
 
     return RESULT_OK;
 }
@@ -534,16 +570,20 @@ static Result op_squash(VM *vm) {
     return RESULT_OK;
 }
 
-UNARY_OP(intNeg, makeInt(-a.as.s32))
+// Int arithmetic wraps around, so is done unsigned to avoid overflowing
+UNARY_OP(intNeg, makeInt((int32_t)(0u - (uint32_t)a.as.s32)))
 UNARY_OP(numNeg, makeNum(-a.as.f64))
 
-BINARY_OP(intAdd, makeInt(a.as.s32 + b.as.s32))
+BINARY_OP(intAdd,
+          makeInt((int32_t)((uint32_t)a.as.s32 + (uint32_t)b.as.s32)))
 BINARY_OP(numAdd, makeNum(a.as.f64 + b.as.f64))
 
-BINARY_OP(intSub, makeInt(a.as.s32 - b.as.s32))
+BINARY_OP(intSub,
+          makeInt((int32_t)((uint32_t)a.as.s32 - (uint32_t)b.as.s32)))
 BINARY_OP(numSub, makeNum(a.as.f64 - b.as.f64))
 
-BINARY_OP(intMul, makeInt(a.as.s32 *b.as.s32))
+BINARY_OP(intMul,
+          makeInt((int32_t)((uint32_t)a.as.s32 * (uint32_t)b.as.s32)))
 BINARY_OP(numMul, makeNum(a.as.f64 *b.as.f64))
 
 BINARY_OP(intDiv, makeInt(a.as.s32 / b.as.s32))
@@ -590,7 +630,7 @@ static Result op_jump(VM *vm) {
     READ(offset)
 
     traceOpcode(vm, "OP_JUMP", false);
-    traceU8(offset, true);
+    traceOperand(offset, true);
 
     vm->ip += offset;
     if (vm->ip > vm->end) {
@@ -607,7 +647,7 @@ static Result op_jumpIfFalse(VM *vm) {
     READ(offset)
 
     traceOpcode(vm, "OP_JUMP_IF_FALSE", false);
-    traceU8(offset, true);
+    traceOperand(offset, true);
 
     POP(cond)
 
@@ -629,7 +669,7 @@ static Result op_loop(VM *vm) {
     READ(offset)
 
     traceOpcode(vm, "OP_LOOP", false);
-    traceU8(offset, true);
+    traceOperand(offset, true);
 
     vm->ip -= offset;
     if (vm->ip < vm->start) {
@@ -646,7 +686,7 @@ static Result op_function(VM *vm) {
     READ(offset)
 
     traceOpcode(vm, "OP_FUNCTION", false);
-    traceU8(offset, true);
+    traceOperand(offset, true);
 
     uint8_t *ip = vm->ip;
     PUSH(makeIP(ip))
@@ -655,20 +695,7 @@ static Result op_function(VM *vm) {
     return RESULT_OK;
 }
 
-static Result op_call(VM *vm) {
-
-    READ(paramCount)
-
-    traceOpcode(vm, "OP_CALL", false);
-    traceU8(paramCount, true);
-
-    POP(function)
-
-    if (function.type != VAL_IP) {
-
-        printf("|| Cannot call to a non-ip value\n");
-        return RESULT_ERR;
-    }
+static Result callFunction(VM *vm, uint8_t *ip, uint16_t paramCount) {
 
     Value *params = ALLOCATE_ARRAY(Value, paramCount);
 
@@ -710,7 +737,7 @@ static Result op_call(VM *vm) {
     PUSH_(makeFP(vm->fp))
 
     vm->fp = vm->sp;
-    vm->ip = function.as.ptr;
+    vm->ip = ip;
 
     PUSHN_(params, paramCount)
 
@@ -723,6 +750,79 @@ static Result op_call(VM *vm) {
     return RESULT_OK;
 }
 
+static Result op_call(VM *vm) {
+
+    READ(paramCount)
+
+    traceOpcode(vm, "OP_CALL", false);
+    traceOperand(paramCount, true);
+
+    POP(function)
+
+    if (function.type != VAL_IP) {
+
+        printf("|| Cannot call to a non-ip value\n");
+        return RESULT_ERR;
+    }
+
+    return callFunction(vm, function.as.ptr, paramCount);
+}
+
+static Result op_callDirect(VM *vm) {
+
+    READ(offset)
+    READ(paramCount)
+
+    traceOpcode(vm, "OP_CALL_DIRECT", false);
+    traceOperand(offset, false);
+    traceOperand(paramCount, true);
+
+    if (vm->ip - vm->start < offset) {
+
+        printf("|| Called out of range\n");
+        return RESULT_ERR;
+    }
+
+    return callFunction(vm, vm->ip - offset, paramCount);
+}
+
+static Result op_tailCall(VM *vm) {
+
+    READ(paramCount)
+
+    traceOpcode(vm, "OP_TAIL_CALL", false);
+    traceOperand(paramCount, true);
+
+    POP(function)
+
+    if (function.type != VAL_IP) {
+
+        printf("|| Cannot call to a non-ip value\n");
+        return RESULT_ERR;
+    }
+
+    if (vm->sp - vm->fp < paramCount) {
+
+        printf("|| Stack underflow\n");
+        return RESULT_ERR;
+    }
+
+    Value *params = vm->sp - paramCount;
+
+    // Discard the current frame, closing any upvalues to it like OP_POP
+    for (Value *value = vm->fp; value < params; value++) {
+
+        closeUpvalues(value);
+    }
+
+    // Keep the return ip and fp beneath the frame, so the call returns to the caller
+    memmove(vm->fp, params, paramCount * sizeof(Value));
+    vm->sp = vm->fp + paramCount;
+    vm->ip = function.as.ptr;
+
+    return RESULT_OK;
+}
+
 static Result op_loadIp(VM *vm) {
 
     traceOpcode(vm, "OP_LOAD_IP", true);
@@ -781,7 +881,7 @@ static Result op_struct(VM *vm) {
     READ(fieldCount)
 
     traceOpcode(vm, "OP_STRUCT", false);
-    traceU8(fieldCount, true);
+    traceOperand(fieldCount, true);
 
     Value result = makeStruct(vm, fieldCount);
     StructObject *structObj = (StructObject *)result.as.obj->ptr;
@@ -798,7 +898,7 @@ static Result op_destruct(VM *vm) {
     READ(dropCount)
 
     traceOpcode(vm, "OP_DESTRUCT", false);
-    traceU8(dropCount, true);
+    traceOperand(dropCount, true);
 
     POP(structValue)
 
@@ -820,7 +920,7 @@ static Result op_getField(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_GET_FIELD", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     POP(structValue)
 
@@ -849,8 +949,8 @@ static Result op_extractField(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_EXTRACT_FIELD", false);
-    traceU8(offset, false);
-    traceU8(index, true);
+    traceOperand(offset, false);
+    traceOperand(index, true);
 
     PEEK(structValue, offset)
 
@@ -879,7 +979,7 @@ static Result op_setField(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_SET_FIELD", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     POP(field)
 
@@ -911,8 +1011,8 @@ static Result op_insertField(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_INSERT_FIELD", false);
-    traceU8(offset, false);
-    traceU8(index, true);
+    traceOperand(offset, false);
+    traceOperand(index, true);
 
     POP(fieldValue)
     PEEK(structValue, offset)
@@ -942,7 +1042,7 @@ static Result op_refLocal(VM *vm) {
     READ(index)
 
     traceOpcode(vm, "OP_REF_LOCAL", false);
-    traceU8(index, true);
+    traceOperand(index, true);
 
     if (index >= vm->sp - vm->fp) {
 
@@ -988,7 +1088,10 @@ static Result op_setRef(VM *vm) {
         return RESULT_ERR;
     }
 
+    // Keep the references to the target like OP_SET_LOCAL, so that it's still
+    // closed when popped
     UpvalueObject *upvalueObj = (UpvalueObject *)upvalue.as.obj->ptr;
+    value.references = upvalueObj->ptr->references;
     *upvalueObj->ptr = value;
 
     return RESULT_OK;
@@ -999,7 +1102,7 @@ static Result op_isValType(VM *vm) {
     READ(val_type)
 
     traceOpcode(vm, "OP_IS_VAL_TYPE", false);
-    traceU8(val_type, true);
+    traceOperand(val_type, true);
 
     PEEK(value, 0)
 
@@ -1013,7 +1116,7 @@ static Result op_isObjType(VM *vm) {
     READ(obj_type)
 
     traceOpcode(vm, "OP_IS_OBJ_TYPE", false);
-    traceU8(obj_type, true);
+    traceOperand(obj_type, true);
 
     PEEK(value, 0)
 
@@ -1022,6 +1125,98 @@ static Result op_isObjType(VM *vm) {
     return RESULT_OK;
 }
 
+static Result jumpTable(VM *vm, uint16_t count, uint16_t index) {
+
+    // The table has an offset for each index followed by the default offset,
+    // all measured from the end of the table
+    size_t width = vm->wide ? sizeof(uint16_t) : sizeof(uint8_t);
+    size_t tableSize = ((size_t)count + 1) * width;
+
+    if ((long)tableSize > vm->end - vm->ip) {
+
+        printf("|| Ran out of bytes reading jump table\n");
+        return RESULT_ERR;
+    }
+
+    uint8_t *tableEnd = vm->ip + tableSize;
+    vm->ip += (index < count ? index : count) * width;
+
+    READ(offset)
+
+    vm->ip = tableEnd + offset;
+    if (vm->ip > vm->end) {
+
+        printf("|| Jumped out of range\n");
+        return RESULT_ERR;
+    }
+
+    return RESULT_OK;
+}
+
+static Result op_switchValType(VM *vm) {
+
+    READ(count)
+
+    traceOpcode(vm, "OP_SWITCH_VALTYPE", false);
+    traceOperand(count, true);
+
+    PEEK(value, 0)
+
+    return jumpTable(vm, count, (uint16_t)value->type);
+}
+
+static Result op_switchTag(VM *vm) {
+
+    READ(count)
+
+    traceOpcode(vm, "OP_SWITCH_TAG", false);
+    traceOperand(count, true);
+
+    PEEK(value, 0)
+
+    // Anything other than a struct tagged with an int uses the default
+    uint16_t tag = count;
+
+    if (value->type == VAL_OBJ && value->as.obj->type == OBJ_STRUCT) {
+
+        StructObject *structObj = (StructObject *)value->as.obj->ptr;
+
+        if (structObj->fieldCount > 0 &&
+            structObj->fields[0].type == VAL_INT &&
+            structObj->fields[0].as.s32 >= 0 &&
+            structObj->fields[0].as.s32 < count) {
+
+            tag = (uint16_t)structObj->fields[0].as.s32;
+        }
+    }
+
+    return jumpTable(vm, count, tag);
+}
+
+static Result op_wide(VM *vm) {
+
+    traceOpcode(vm, "OP_WIDE", true);
+
+    uint8_t opcode;
+    if (readU8(vm, &opcode) != RESULT_OK) {
+
+        printf("|| Could not read widened opcode\n");
+        return RESULT_ERR;
+    }
+
+    if (opcode >= OP_COUNT || opcode == OP_WIDE) {
+
+        printf("|| Cannot widen opcode %d\n", opcode);
+        return RESULT_ERR;
+    }
+
+    vm->wide = true;
+    Result result = vm->instructions[opcode](vm);
+    vm->wide = false;
+
+    return result;
+}
+
 #undef BINARY_OP
 #undef UNARY_OP
 #undef READ
@@ -1039,6 +1234,7 @@ Result initVM(VM *vm) {
     vm->end = NULL;
 
     vm->ip = NULL;
+    vm->wide = false;
     vm->fp = vm->stack;
     vm->sp = vm->stack;
 
@@ -1123,6 +1319,14 @@ Result initVM(VM *vm) {
     INSTR(OP_IS_VAL_TYPE, op_isValType);
     INSTR(OP_IS_OBJ_TYPE, op_isObjType);
 
+    INSTR(OP_WIDE, op_wide);
+
+    INSTR(OP_TAIL_CALL, op_tailCall);
+    INSTR(OP_CALL_DIRECT, op_callDirect);
+
+    INSTR(OP_SWITCH_VALTYPE, op_switchValType);
+    INSTR(OP_SWITCH_TAG, op_switchTag);
+
 #undef INSTR
 
     return RESULT_OK;
@@ -1133,8 +1337,14 @@ static Result loadConstants(VM *vm, uint8_t *code, size_t length,
 
     size_t index = 0;
 
-    size_t constantCount = *(uint8_t *)code;
-    index = index + sizeof(uint8_t);
+    if (length < sizeof(uint16_t)) {
+
+        printf("|| EOF reached while parsing constant count\n");
+        return RESULT_ERR;
+    }
+
+    size_t constantCount = *(uint16_t *)code;
+    index = index + sizeof(uint16_t);
 
     vm->constants =
         GROW_ARRAY(vm->constants, Value, vm->constantCount, constantCount);
@@ -1182,17 +1392,17 @@ static Result loadConstants(VM *vm, uint8_t *code, size_t length,
 
                 index++;
 
-                if (index > length - sizeof(uint8_t)) {
+                if (index > length - sizeof(uint32_t)) {
 
                     printf(
                         "\n|| EOF reached instead of constant string length\n");
                     return RESULT_ERR;
                 }
 
-                uint8_t strLength = *(uint8_t *)(code + index);
-                index += sizeof(uint8_t);
+                uint32_t strLength = *(uint32_t *)(code + index);
+                index += sizeof(uint32_t);
 
-                if (index > length - strLength) {
+                if (strLength > length - index) {
 
                     printf("\n|| Reached EOF while parsing constant string\n");
                     return RESULT_ERR;
@@ -7,7 +7,7 @@
 
 typedef Result (*Instruction)(VM *vm);
 
-#define GLOBAL_MAX 256
+#define GLOBAL_MAX 65536
 
 typedef struct {
 
@@ -30,6 +30,7 @@ struct sVM {
     Value returnStore;
 
     uint8_t *ip; // instruction pointer; points to next instruction to execute
+    bool wide;   // whether the current instruction has 16-bit operands
     Value *fp;   // frame pointer; points to first local in current frame
     Value *sp;   // stack pointer; points to next available value on stack
 
@@ -0,0 +1,46 @@
+#!/bin/sh
+
+# Compiles and runs every program in test/, checking that what it prints matches the expected
+# output listed in the comment at the end of its source.
+
+set -e
+
+echo ""
+echo "-- Compiling VM --"
+
+mkdir -p ClearVM/build
+(cd ClearVM/build && rm -f CMakeCache.txt && cmake .. > /dev/null && make > /dev/null)
+
+failed=0
+
+for source in test/*.clr; do
+    module=${source%.clr}
+    name=${module#test/}
+
+    expected=$(sed -n '/^\/\/ Expected output:$/,$p' "$source" | tail -n +2 | sed 's#^// \{0,1\}##')
+    if [ -z "$expected" ]; then
+        echo "$name: no expected output"
+        continue
+    fi
+
+    if ! (cd ClearC && python clrc.py "../$module" > /dev/null); then
+        echo "$name: FAILED to compile"
+        failed=1
+        continue
+    fi
+
+    # The output of the program is fenced after the disassembly
+    actual=$(./ClearVM/build/clr "$module" | sed -n '/^Running:$/,$p' | sed '1,2d;$d')
+    if [ "$actual" = "$expected" ]; then
+        echo "$name: ok"
+    else
+        echo "$name: FAILED"
+        echo "$expected" > "$module.expected"
+        echo "$actual" > "$module.actual"
+        diff "$module.expected" "$module.actual" || true
+        rm "$module.expected" "$module.actual"
+        failed=1
+    fi
+done
+
+exit $failed